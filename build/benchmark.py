@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+
+import build
+
+# Benchmarks the copy, strip and zip stages of build.py on a generated output tree, no dotnet needed
+# python benchmark.py --files 400 --runs 3 [--json results.json]
+
+Builds = ["win-x64", "linux-x64", "osx-arm64", "portable"]
+
+def WriteFile(path: str, size: int, rng: random.Random, compressible: bool):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        if compressible:
+            # managed dlls compress to roughly a third, repeat a random block to get similar ratios
+            block = rng.randbytes(4096) + bytes(8192)
+            file.write((block * (size // len(block) + 1))[:size])
+        else:
+            file.write(rng.randbytes(size))
+
+def CreateDeps(root: str, rng: random.Random, fileSize: int):
+    for os_, exe in (("win", ".exe"), ("linux", ""), ("osx", "")):
+        for name in ("ffmpeg", "ffprobe"):
+            WriteFile(os.path.join(root, "deps", "ffmpeg", os_, name + exe), fileSize * 32, rng, False)
+        WriteFile(os.path.join(root, "deps", "mediainfo", os_, "mediainfo" + exe), fileSize * 8, rng, False)
+    WriteFile(os.path.join(root, "deps", "mpv", "win", "libmpv-2.dll"), fileSize * 64, rng, False)
+    WriteFile(os.path.join(root, "deps", "mpv", "linux-2.1.0", "libmpv.so.2"), fileSize * 16, rng, False)
+    WriteFile(os.path.join(root, "deps", "mpv", "osx-arm64-2.1.0", "libmpv.2.dylib"), fileSize * 16, rng, False)
+    for rid in ("win-x64", "linux-x64", "osx-arm64", "portable"):
+        WriteFile(os.path.join(root, "deps", "cyber-lib", "build", rid, "UpdaterAvalonia"), fileSize * 48, rng, True)
+        WriteFile(os.path.join(root, "deps", "cyber-lib", "build", rid, "UpdaterAvalonia.pdb"), fileSize, rng, True)
+    for name in ("README.md", "LICENSE.md", "LICENSE-3RD-PARTY.md"):
+        WriteFile(os.path.join(root, "docs", name), fileSize // 4, rng, True)
+
+def CreateOutput(output: str, files: int, fileSize: int, seed: int):
+    """A publish-like tree per build: dlls, pdbs, native libs and an osx .dSYM bundle"""
+    rng = random.Random(seed)
+    for target in Builds:
+        dir = os.path.join(output, target)
+        for i in range(files):
+            size = max(1, int(rng.expovariate(1 / fileSize)))
+            WriteFile(os.path.join(dir, f"Assembly{i}.dll"), size, rng, True)
+            if i % 4 == 0:
+                WriteFile(os.path.join(dir, f"Assembly{i}.pdb"), size // 2 + 1, rng, True)
+        WriteFile(os.path.join(dir, "libSkiaSharp.so"), fileSize * 16, rng, False)
+        WriteFile(os.path.join(dir, "Assets", "logo.png"), fileSize * 2, rng, False)
+        if target.startswith("linux"):
+            WriteFile(os.path.join(dir, "CyberPlayer.dbg"), fileSize * 8, rng, True)
+        if target.startswith("osx"):
+            WriteFile(os.path.join(dir, "CyberPlayer.dSYM", "Contents", "Resources", "DWARF", "CyberPlayer"), fileSize * 8, rng, True)
+
+def Copy():
+    build.CopyMDs()
+    build.CopyFFmpeg()
+    build.CopyMpvLib()
+    build.CopyMediaInfo()
+    build.CopyUpdater()
+
+Stages = [
+    ("copy", Copy),
+    ("copy (up to date)", Copy),
+    ("strip", build.RemovePDBs),
+    ("zip", build.ZipBuilds),
+]
+
+def Main():
+    parser = argparse.ArgumentParser(description="Benchmarks the copy, strip and zip stages of build.py on a synthetic output tree")
+    parser.add_argument("--files", type=int, default=400, help="files per build")
+    parser.add_argument("--size", type=int, default=64, help="mean file size in KiB")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=None, help="same as build.py -jobs")
+    parser.add_argument("--level", type=int, default=6, help="same as build.py -archivelevel")
+    parser.add_argument("--hardlinks", action="store_true", help="same as build.py -hardlinks")
+    parser.add_argument("--dir", default=None, help="where to generate the tree, a temp dir by default (use it to pick the filesystem)")
+    parser.add_argument("--json", default=None, help="write the results here to compare runs")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="cvp-bench-", dir=args.dir)
+    fileSize = args.size * 1024
+    build.OutputDir = os.path.join(root, "output")
+    build.DepsDir = os.path.join(root, "deps")
+    build.DocsDir = os.path.join(root, "docs")
+    build.LogsDir = os.path.join(root, "logs")
+    build.Jobs = args.jobs
+    build.CompressionLevel = args.level
+    build.HardlinkStaging = args.hardlinks
+    build.ProfileSpans = []
+    results = {name: [] for name, _ in Stages}
+    try:
+        CreateDeps(root, random.Random(0), fileSize)
+        for run in range(args.runs):
+            shutil.rmtree(build.OutputDir, ignore_errors=True)
+            CreateOutput(build.OutputDir, args.files, fileSize, run)
+            build.OutputTree = None # generated behind the index's back
+            for name, stage in Stages:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    with build.Span(name, "benchmark"):
+                        stage()
+                results[name].append(build.ProfileSpans[-1])
+            print(f"run {run + 1}/{args.runs} done", file=sys.stderr)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"{args.files} files per build, {len(Builds)} builds, mean size {args.size} KiB, jobs {args.jobs or os.cpu_count()}, level {args.level}")
+    print(f"{'stage':<18} {'min':>8} {'median':>8} {'max':>8} {'read MiB':>9} {'written MiB':>12} {'archived MiB':>13}")
+    summary = {}
+    for name, spans in results.items():
+        walls = [span["wall"] for span in spans]
+        last = spans[-1]
+        summary[name] = {"min": min(walls), "median": statistics.median(walls), "max": max(walls), "read": last["read"], "written": last["written"], "archived": last["archived"]}
+        print(f"{name:<18} {min(walls):>7.3f}s {statistics.median(walls):>7.3f}s {max(walls):>7.3f}s "
+            f"{build.FormatMiB(last['read']):>9} {build.FormatMiB(last['written']):>12} {build.FormatMiB(last['archived']):>13}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({"args": vars(args), "stages": summary}, file, indent=4)
+
+if __name__ == "__main__":
+    Main()
@@ -1,40 +1,9 @@
 #!/bin/sh
 
 BUILD_DIR=$( dirname -- "$( readlink -f -- "$0"; )"; )
-REPO_DIR=$( dirname "$BUILD_DIR" )
 OUTPUT_DIR="$BUILD_DIR/output"
-CFG_DIR="$BUILD_DIR/setup-config-linux"
 PY_SCRIPT="$BUILD_DIR/build.py"
 
-CreateSetup() {
-    local STAGE="$OUTPUT_DIR/CVP-$1"
-    local ASSETS="$STAGE/assets"
-    local PUBLISH_OUTPUT_DIRECTORY="$OUTPUT_DIR/$1/."
-    local ICONS="$REPO_DIR/src/CyberPlayer.Player/Assets/Logo/cyber-logo-sunset.iconset/."
-
-    echo "creating setup for $1 ..."
-
-    mkdir -p "$ASSETS"
-    mkdir -p "$STAGE/CyberVideoPlayer"
-
-    # Main program files
-    cp -f -a "$PUBLISH_OUTPUT_DIRECTORY" "$STAGE/CyberVideoPlayer"
-
-    # Desktop shortcut
-    cp -f "$CFG_DIR/cybervideoplayer.desktop" "$ASSETS/cybervideoplayer.desktop"
-
-    # Hicolor icons
-    cp -f -a "$ICONS" "$ASSETS"
-
-    # Installation script
-    cp -f "$CFG_DIR/install.sh" "$STAGE/install.sh"
-    chmod +x "$STAGE/install.sh"
-
-    echo "archiving CVP-$1-setup ..."
-    cd "$OUTPUT_DIR"
-    tar -czf CVP-$1-setup.tar.gz CVP-$1
-}
-
 set -e
 
 git pull
@@ -64,9 +33,5 @@ fi
 
 chmod -R 777 "$OUTPUT_DIR"
 
-cd "$OUTPUT_DIR"
-
-echo "archiving linux-x64 ..."
-tar -czf linux-x64.tar.gz linux-x64
-
-CreateSetup "linux-x64"
+# linux-x64.tar.gz and CVP-linux-x64-setup.tar.gz
+$PYTHON "$PY_SCRIPT" -linuxpkg "linux-x64"
@@ -38,22 +38,6 @@ CreateAppPackageAndPKG() {
     cd "$dir"
 }
 
-TarBuilds() {
-    local dir="$(pwd)"
-    cd "$OUTPUT_DIR"
-    if [ "$ARCHITECTURE" = "osx-arm64;osx-x64" ]
-    then
-        echo "archiving osx-arm64 ..."
-        tar -czf "osx-arm64.tar.gz" "osx-arm64"
-        echo "archiving osx-x64 ..."
-        tar -czf "osx-x64.tar.gz" "osx-x64"
-    else
-        echo "archiving $ARCHITECTURE ..."
-        tar -czf "$ARCHITECTURE.tar.gz" "$ARCHITECTURE"
-    fi
-    cd "$dir"
-}
-
 set -e
 
 git pull
@@ -97,7 +81,7 @@ then
     else
         $PYTHON "$PY_SCRIPT" -version $VERSION -compile $ARCHITECTURE -cpymds -cpyffmpeg -cpymediainfo -cpyupdater -rmpdbs -delbinrel
     fi
-    TarBuilds
+    $PYTHON "$PY_SCRIPT" -targz "$ARCHITECTURE"
 fi
 
 if [ "$BUILD_BUNDLE" != "y" ]
@@ -8,8 +8,23 @@ import collections
 import re
 import json
 import urllib.request
+import http.client
+import urllib.error
+import urllib.parse
+import hashlib
 import tarfile
 import functools
+import io
+import zlib
+import struct
+import tempfile
+import threading
+import time
+import concurrent.futures
+try:
+    import resource
+except ImportError: # windows, spans there only record wall time
+    resource = None
 
 PLIST_VERSION_PLACEHOLDER = r"${VERSION}"
 
@@ -17,9 +32,12 @@ BuildDir = os.path.dirname(os.path.realpath(__file__))
 RepoDir = os.path.dirname(BuildDir)
 OutputDir = os.path.join(BuildDir, "output")
 DepsDir = os.path.join(RepoDir, "deps")
+CacheDir = os.path.join(DepsDir, ".cache")
 DocsDir = os.path.join(RepoDir, "docs")
 ConfigOsxDir = os.path.join(BuildDir, "setup-config-osx")
 ConfigWinDir = os.path.join(BuildDir, "setup-config-win")
+LogsDir = os.path.join(BuildDir, "logs")
+PlayerCsproj = os.path.join(RepoDir, "src", "CyberPlayer.Player", "CyberPlayer.Player.csproj")
 
 Version: str | None = None
 VMajor: int | None = None
@@ -28,6 +46,25 @@ VPatch: int | None = None
 VIdentifier: str | None = None
 VBuild: int | None = None
 
+Jobs: int | None = None
+FailFast = True
+RestoreOnce = False
+WarmBuildArgs: list[str] = []
+Mirror: str | None = None
+CompressionLevel = 6
+# Entry timestamps in archives, fixed so archives are byte reproducible (1980-01-01 is the zip minimum)
+ArchiveEpoch = int(os.environ.get("SOURCE_DATE_EPOCH", 315532800))
+ArchiveChunkSize = 1024 * 1024
+HardlinkStaging = False # hardlinked files share their mode with deps/ and docs/, so a chmod of the output would change the sources
+IncompressibleExtensions = {".zip", ".gz", ".tgz", ".xz", ".7z", ".bz2", ".zst", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".icns", ".mp4", ".mkv", ".webm"}
+Offline = False
+RestoreSeconds = 0.0
+RestoreCount = 0
+SkippedRestoreCount = 0
+InjectVersion = False
+ProfileSpans: list[dict] | None = None # set by -profile
+ProfileCounters = ("cpu", "read", "written", "downloaded", "archived")
+
 print = functools.partial(print, flush=True)
 
 def getOS() -> str:
@@ -62,19 +99,6 @@ CompileTargets = {
     "portable": f"-o {os.path.join(OutputDir, 'portable')} -c release-portable --sc false -p:AssemblyVersion=1.0.0.0 -p:Version=1.0.0.0",
 }
 
-class cd:
-    """Context manager for changing the current working directory"""
-    def __init__(self, newPath):
-        self.newPath = os.path.expanduser(newPath)
-
-    def __enter__(self):
-        self.savedPath = os.getcwd()
-        os.chdir(self.newPath)
-
-    def __exit__(self, etype, value, traceback):
-        os.chdir(self.savedPath)
-
-
 def ListFiles(dir: str = os.getcwd(), recursive = False, filter: str | None = None, exclude: str | None = None) -> list[str]:
     r = []
     for root, dirs, files in os.walk(dir):
@@ -95,6 +119,117 @@ def ListDirs(dir: str, recursive = False) -> list[str]:
             break
     return r
 
+IndexEntry = collections.namedtuple('IndexEntry', ['path', 'target', 'name', 'size', 'mtime'])
+
+class OutputIndex:
+    """
+    Every file and dir in OutputDir from a single os.scandir walk, kept up to date by the steps that change it
+    Entries are keyed by their path relative to OutputDir, their target is the build dir they are in (None for
+    archives and installers at the top level). Dot files at the top level are build state and are left out
+    """
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.lock = threading.RLock()
+        self.files: dict[str, IndexEntry] = {}
+        self.dirs: set[str] = set()
+        if os.path.isdir(self.root):
+            self.Scan(self.root)
+
+    def Key(self, path: str) -> str | None:
+        key = os.path.relpath(os.path.abspath(path), self.root)
+        if key == "." or key.startswith(".." + os.sep) or key == ".." or os.path.isabs(key):
+            return None
+        return key
+
+    def Scan(self, dir: str):
+        stack = [dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    key = self.Key(entry.path)
+                    if os.sep not in key and entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        self.dirs.add(key)
+                        stack.append(entry.path)
+                    else:
+                        stat = entry.stat(follow_symlinks=False)
+                        target = key.split(os.sep, 1)[0] if os.sep in key else None
+                        self.files[key] = IndexEntry(entry.path, target, key, stat.st_size, stat.st_mtime_ns)
+
+    def Remove(self, path: str):
+        """Drops path and everything under it, or the whole index for OutputDir itself"""
+        key = self.Key(path)
+        with self.lock:
+            if key == None:
+                if os.path.abspath(path) == self.root:
+                    self.files.clear()
+                    self.dirs.clear()
+                return
+            prefix = key + os.sep
+            for name in [name for name in self.files if name == key or name.startswith(prefix)]:
+                del self.files[name]
+            self.dirs -= {name for name in self.dirs if name == key or name.startswith(prefix)}
+
+    def Refresh(self, path: str):
+        """Re-reads path (a file, a dir or OutputDir) after something outside the index changed it"""
+        key = self.Key(path)
+        with self.lock:
+            self.Remove(path)
+            if key == None and os.path.abspath(path) != self.root:
+                return
+            if os.path.isdir(path):
+                if key != None:
+                    self.dirs.add(key)
+                self.Scan(path)
+            elif os.path.lexists(path):
+                stat = os.lstat(path)
+                parts = key.split(os.sep)
+                for i in range(1, len(parts)):
+                    self.dirs.add(os.sep.join(parts[:i]))
+                self.files[key] = IndexEntry(os.path.abspath(path), parts[0] if len(parts) > 1 else None, key, stat.st_size, stat.st_mtime_ns)
+
+    def Builds(self) -> list[str]:
+        with self.lock:
+            return [os.path.join(self.root, name) for name in sorted(self.dirs) if os.sep not in name]
+
+    def Files(self, target: str | None = None, extensions: tuple[str, ...] | None = None, under: str | None = None) -> list[IndexEntry]:
+        """Files in target and/or under a path, optionally by extension (case insensitive)"""
+        prefix = self.Key(under) + os.sep if under != None else None
+        with self.lock:
+            files = list(self.files.values())
+        return sorted((file for file in files
+            if (target == None or file.target == target)
+            and (extensions == None or file.name.lower().endswith(extensions))
+            and (prefix == None or file.name.startswith(prefix))), key=lambda file: file.name)
+
+    def Dirs(self, target: str | None = None, extensions: tuple[str, ...] | None = None, under: str | None = None) -> list[str]:
+        prefix = self.Key(under) + os.sep if under != None else None
+        with self.lock:
+            dirs = sorted(self.dirs)
+        return [os.path.join(self.root, name) for name in dirs
+            if (target == None or name.split(os.sep, 1)[0] == target and os.sep in name)
+            and (extensions == None or name.lower().endswith(extensions))
+            and (prefix == None or name.startswith(prefix))]
+
+OutputTree: OutputIndex | None = None
+OutputTreeLock = threading.Lock()
+
+def Output() -> OutputIndex:
+    """The index of OutputDir, walked on first use"""
+    global OutputTree
+    with OutputTreeLock:
+        if OutputTree == None or OutputTree.root != os.path.abspath(OutputDir):
+            OutputTree = OutputIndex(OutputDir)
+        return OutputTree
+
+def TargetPlatform(target: str) -> str | None:
+    """win, linux, osx or portable for a build dir name like osx-arm64"""
+    for name in ("portable", "win", "linux", "osx"):
+        if target == name or target.startswith(name + "-"):
+            return name
+    return None
+
 def ParseCmds(cmds: str) -> list[str]:
     r = []
     s = ""
@@ -111,55 +246,902 @@ def ParseCmds(cmds: str) -> list[str]:
         r.append(s)
     return r
 
-def ZipDirProgress(path: str, zipHandle: zipfile.ZipFile):
-    for root, dir, files in os.walk(path):
-        for file in files:
-            print(f"Zipping {file}")
-            zipHandle.write(os.path.join(root, file), os.path.relpath(os.path.join(root, file), os.path.join(path, '..')))
-    print("Finished zipping")
+ArchiveEntry = collections.namedtuple('ArchiveEntry', ['name', 'source', 'mode'], defaults=[None])
+CompressedFile = collections.namedtuple('CompressedFile', ['size', 'crc', 'mode', 'pieces', 'stored'])
+
+Crc32Powers: list[list[int]] = []
+
+def Crc32Combine(crc1: int, crc2: int, len2: int) -> int:
+    """zlib's crc32_combine, which python does not expose, with the zero operators for each power of two cached"""
+    def Times(matrix: list[int], vector: int) -> int:
+        result = 0
+        i = 0
+        while vector:
+            if vector & 1:
+                result ^= matrix[i]
+            vector >>= 1
+            i += 1
+        return result
+
+    if not Crc32Powers:
+        powers = []
+        matrix = [0xedb88320] + [1 << n for n in range(31)] # one zero bit
+        for _ in range(3 + 64):
+            matrix = [Times(matrix, matrix[n]) for n in range(32)]
+            powers.append(matrix)
+        Crc32Powers[:] = powers[2:] # keep from one zero byte up, filled in one go for concurrent archives
+    power = 0
+    while len2:
+        if len2 & 1:
+            crc1 = Times(Crc32Powers[power], crc1)
+        len2 >>= 1
+        power += 1
+    return crc1 ^ crc2
+
+def IsIncompressible(path: str) -> bool:
+    if os.path.splitext(path)[1].lower() in IncompressibleExtensions:
+        return True
+    with open(path, 'rb') as file:
+        sample = file.read(64 * 1024)
+    return len(sample) >= 4096 and len(zlib.compress(sample, 1)) > len(sample) * 0.95
+
+def CompressChunk(path: str, offset: int, length: int, level: int) -> tuple[bytes, int]:
+    # Every chunk is its own raw deflate stream ending on a full flush, so chunks can be concatenated
+    # in any archive (the pigz approach). Level 0 writes stored blocks
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read(length)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH), zlib.crc32(data)
+
+def CompressFiles(sources: list[str], spool, level: int, jobs: int) -> dict[str, CompressedFile]:
+    """Reads and compresses every source once, in parallel chunks, into spool"""
+    chunks = []
+    stored = set()
+    for source in sources:
+        if IsIncompressible(source):
+            stored.add(source)
+        for offset in range(0, os.path.getsize(source), ArchiveChunkSize):
+            chunks.append((source, offset))
+
+    crcs = {source: 0 for source in sources}
+    sizes = {source: 0 for source in sources}
+    pieces = {source: [] for source in sources}
+
+    def Collect(source: str, future: concurrent.futures.Future):
+        data, crc = future.result()
+        length = min(ArchiveChunkSize, os.path.getsize(source) - sizes[source])
+        pieces[source].append((spool.tell(), len(data)))
+        spool.write(data)
+        crcs[source] = Crc32Combine(crcs[source], crc, length)
+        sizes[source] += length
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for source, offset in chunks:
+            pending.append((source, executor.submit(CompressChunk, source, offset, ArchiveChunkSize, 0 if source in stored else level)))
+            if len(pending) > jobs * 4:
+                Collect(*pending.popleft())
+        while pending:
+            Collect(*pending.popleft())
+
+    return {
+        source: CompressedFile(sizes[source], crcs[source], 0o755 if os.stat(source).st_mode & 0o111 else 0o644, pieces[source], source in stored)
+        for source in sources
+    }
+
+def CopyPieces(spool, pieces: list[tuple[int, int]], out):
+    for offset, length in pieces:
+        spool.seek(offset)
+        out.write(spool.read(length))
+
+def WriteTarGz(path: str, entries: list[ArchiveEntry], files: dict[str, CompressedFile], spool, level: int):
+    crc = 0
+    size = 0
+    metadata = bytearray()
+
+    def FlushMetadata(out):
+        nonlocal crc, size
+        if metadata:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            out.write(compressor.compress(metadata) + compressor.flush(zlib.Z_FULL_FLUSH))
+            crc = zlib.crc32(metadata, crc)
+            size += len(metadata)
+            metadata.clear()
+
+    with open(path + ".tmp", 'wb') as out:
+        out.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff") # gzip header, no mtime, unknown os
+        for entry in entries:
+            info = tarfile.TarInfo(entry.name)
+            info.mtime = ArchiveEpoch
+            if entry.source == None:
+                info.type = tarfile.DIRTYPE
+                info.mode = entry.mode or 0o755
+                metadata += info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+                continue
+            file = files[entry.source]
+            info.size = file.size
+            info.mode = entry.mode or file.mode
+            metadata += info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+            FlushMetadata(out)
+            CopyPieces(spool, file.pieces, out)
+            crc = Crc32Combine(crc, file.crc, file.size)
+            size += file.size
+            metadata += b"\0" * (-file.size % tarfile.BLOCKSIZE)
+        metadata += b"\0" * (tarfile.BLOCKSIZE * 2)
+        FlushMetadata(out)
+        out.write(b"\x03\x00") # empty final block
+        out.write(struct.pack("<II", crc, size & 0xffffffff))
+    os.replace(path + ".tmp", path)
+
+def WriteZip(path: str, entries: list[ArchiveEntry], files: dict[str, CompressedFile], spool):
+    timestamp = time.gmtime(ArchiveEpoch)
+    dosTime = timestamp.tm_hour << 11 | timestamp.tm_min << 5 | timestamp.tm_sec // 2
+    dosDate = (timestamp.tm_year - 1980) << 9 | timestamp.tm_mon << 5 | timestamp.tm_mday
+    central = []
+    with open(path + ".tmp", 'wb') as out:
+        for entry in entries:
+            offset = out.tell()
+            if entry.source == None:
+                name = entry.name + "/"
+                method, crc, compressedSize, size = 0, 0, 0, 0
+                attributes = (0o40000 | (entry.mode or 0o755)) << 16 | 0x10
+            else:
+                file = files[entry.source]
+                name = entry.name
+                method, crc, size = 8, file.crc, file.size
+                compressedSize = sum(length for offset, length in file.pieces) + 2
+                attributes = (0o100000 | (entry.mode or file.mode)) << 16
+            if max(offset, compressedSize, size) >= 0xffffffff:
+                raise Exception(f"{path} needs zip64, which is not supported")
+            nameBytes = name.encode("utf-8")
+            flags = 0 if name.isascii() else 0x800
+            out.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, 20, flags, method, dosTime, dosDate, crc, compressedSize, size, len(nameBytes), 0))
+            out.write(nameBytes)
+            if entry.source != None:
+                CopyPieces(spool, file.pieces, out)
+                out.write(b"\x03\x00") # empty final block
+            central.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, 3 << 8 | 20, 20, flags, method, dosTime, dosDate, crc, compressedSize, size, len(nameBytes), 0, 0, 0, 0, attributes, offset) + nameBytes)
+        if len(central) > 0xffff:
+            raise Exception(f"{path} needs zip64, which is not supported")
+        centralOffset = out.tell()
+        for record in central:
+            out.write(record)
+        out.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, len(central), len(central), out.tell() - centralOffset, centralOffset, 0))
+    os.replace(path + ".tmp", path)
+
+def DirLayout(root: str, prefix: str = "") -> list[ArchiveEntry]:
+    """Entries for everything under root, named relative to it below prefix"""
+    entries = [ArchiveEntry(prefix, None)] if prefix else []
+    output = Output()
+    if output.Key(root) != None:
+        base = prefix + "/" if prefix else ""
+        for dir in output.Dirs(under=root):
+            entries.append(ArchiveEntry(base + os.path.relpath(dir, root).replace(os.sep, "/"), None))
+        for file in output.Files(under=root):
+            entries.append(ArchiveEntry(base + os.path.relpath(file.path, root).replace(os.sep, "/"), file.path))
+        return entries
+    for dirpath, dirnames, filenames in os.walk(root):
+        relative = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        base = "/".join(part for part in (prefix, relative) if part and part != ".")
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            entries.append(ArchiveEntry(f"{base}/{name}" if base else name, None if os.path.isdir(path) else path))
+    return entries
+
+def WriteArchives(layouts: dict[str, list[ArchiveEntry]]):
+    """
+    Writes every archive (.zip or .tar.gz) in layouts from a single read of their files
+    Files are compressed once in parallel chunks and shared between archives, entries are sorted and
+    timestamps fixed so the output is reproducible
+    """
+    start = time.monotonic()
+    sources = sorted({entry.source for entries in layouts.values() for entry in entries if entry.source != None})
+    jobs = Jobs or os.cpu_count() or 1
+    with tempfile.TemporaryFile() as spool:
+        print(f"Compressing {len(sources)} files with {jobs} job(s) at level {CompressionLevel} ...")
+        files = CompressFiles(sources, spool, CompressionLevel, jobs)
+        for path, entries in layouts.items():
+            print(f"Writing {os.path.basename(path)} ...")
+            entries = sorted(entries, key=lambda entry: entry.name)
+            if path.endswith(".zip"):
+                WriteZip(path, entries, files, spool)
+            elif path.endswith(".tar.gz"):
+                WriteTarGz(path, entries, files, spool, CompressionLevel)
+            else:
+                raise Exception(f"{path} is not a supported archive type")
+        read = sum(file.size for file in files.values())
+        stored = sum(1 for file in files.values() if file.stored)
+    CountBytes("read", read)
+    CountBytes("archived", sum(os.path.getsize(path) for path in layouts))
+    for path in layouts:
+        Output().Refresh(path)
+    print(f"Archived {read} bytes ({stored} files stored) into {len(layouts)} archive(s) in {time.monotonic() - start:.1f}s")
+
+class Staging:
+    """
+    Places files into the output with a reflink, a hardlink (with -hardlinks) or a copy, in that order of preference
+    A manifest of source size, mtime and hash lets files that are already up to date be skipped
+    """
+    ReflinkDevices: dict[int, bool] = {}
+    ManifestLock = threading.Lock() # cpy* commands may stage at the same time
+
+    def __enter__(self):
+        self.manifestPath = os.path.join(OutputDir, ".staging.json")
+        self.manifest = {}
+        if os.path.isfile(self.manifestPath):
+            with open(self.manifestPath, 'r') as file:
+                self.manifest = json.load(file)
+        self.staged = {}
+        self.stats = collections.Counter()
+        return self
 
-def CopyFilesProgress(files: list[str] | str, dest: str):
+    def __exit__(self, etype, value, traceback):
+        os.makedirs(OutputDir, exist_ok=True)
+        with Staging.ManifestLock:
+            manifest = {}
+            if os.path.isfile(self.manifestPath):
+                with open(self.manifestPath, 'r') as file:
+                    manifest = json.load(file)
+            manifest.update(self.staged)
+            with open(self.manifestPath + ".tmp", 'w') as file:
+                json.dump(manifest, file, indent=4)
+            os.replace(self.manifestPath + ".tmp", self.manifestPath)
+        stats = self.stats
+        print(f"Staged {stats['files']} file(s): {stats['linked']} bytes linked, {stats['copied']} bytes copied, {stats['skipped']} bytes up to date")
+
+    def IsUpToDate(self, source: str, dest: str, sourceStat: os.stat_result) -> bool:
+        if not os.path.isfile(dest):
+            return False
+        if os.path.samefile(source, dest):
+            return HardlinkStaging # a hardlink from an earlier run is replaced by a copy unless -hardlinks
+        record = self.manifest.get(dest)
+        destStat = os.stat(dest)
+        if record == None or record["source"] != source or record["size"] != sourceStat.st_size or destStat.st_size != sourceStat.st_size or destStat.st_mtime_ns != record["destMtime"]:
+            return False
+        if record["mtime"] == sourceStat.st_mtime_ns:
+            return True
+        # Touched but possibly identical, e.g. re-extracted with a new mtime
+        if record["sha256"] != None and record["sha256"] == FileSha256(source):
+            record["mtime"] = sourceStat.st_mtime_ns
+            return True
+        return False
+
+    def Reflink(self, source: str, dest: str) -> bool:
+        device = os.stat(os.path.dirname(dest)).st_dev
+        if self.ReflinkDevices.get(device) == False:
+            return False
+        try:
+            if OS == "linux":
+                import fcntl
+                with open(source, 'rb') as sourceFile, open(dest, 'wb') as destFile:
+                    fcntl.ioctl(destFile.fileno(), 0x40049409, sourceFile.fileno()) # FICLONE
+                shutil.copymode(source, dest)
+            elif OS == "osx":
+                import ctypes
+                if ctypes.CDLL(None, use_errno=True).clonefile(source.encode(), dest.encode(), 0) != 0:
+                    raise OSError(ctypes.get_errno(), "clonefile failed")
+            else:
+                return False
+        except OSError:
+            if os.path.isfile(dest):
+                os.remove(dest)
+            self.ReflinkDevices[device] = False
+            return False
+        self.ReflinkDevices[device] = True
+        return True
+
+    def Hardlink(self, source: str, dest: str) -> bool:
+        try:
+            os.link(source, dest)
+            return True
+        except OSError:
+            return False
+
+    def Copy(self, source: str, dest: str) -> str:
+        sha = hashlib.sha256()
+        with open(source, 'rb') as sourceFile, open(dest, 'wb') as destFile:
+            for chunk in iter(lambda: sourceFile.read(1024 * 1024), b""):
+                sha.update(chunk)
+                destFile.write(chunk)
+        shutil.copymode(source, dest)
+        CountBytes("read", os.path.getsize(source))
+        CountBytes("written", os.path.getsize(dest))
+        return sha.hexdigest()
+
+    def Stage(self, source: str, dest: str):
+        source = os.path.abspath(source)
+        dest = os.path.abspath(dest)
+        sourceStat = os.stat(source)
+        self.stats["files"] += 1
+        if self.IsUpToDate(source, dest, sourceStat):
+            print(f"Up to date {dest}")
+            self.stats["skipped"] += sourceStat.st_size
+            return
+        if os.path.lexists(dest):
+            os.remove(dest)
+        sha256 = None
+        if self.Reflink(source, dest):
+            print(f"Reflinking {source} to {dest} ...")
+            self.stats["linked"] += sourceStat.st_size
+        elif HardlinkStaging and self.Hardlink(source, dest):
+            print(f"Linking {source} to {dest} ...")
+            self.stats["linked"] += sourceStat.st_size
+        else:
+            print(f"Copying {source} to {dest} ...")
+            sha256 = self.Copy(source, dest)
+            self.stats["copied"] += sourceStat.st_size
+        self.manifest[dest] = self.staged[dest] = {
+            "source": source,
+            "size": sourceStat.st_size,
+            "mtime": sourceStat.st_mtime_ns,
+            "sha256": sha256,
+            "destMtime": os.stat(dest).st_mtime_ns,
+        }
+        Output().Refresh(dest)
+
+def CopyFilesProgress(files: list[str] | str, dest: str, suffix: str = ""):
+    """Stages files into dest, suffix is appended to each file name before its extension"""
     if not os.path.exists(dest) or not os.path.isdir(dest):
         os.makedirs(dest, exist_ok=True)
     if isinstance(files, str):
-        print(f"Copying {files} to {dest} ...")
-        shutil.copy(files, dest)
-    else:
+        files = [files]
+    with Staging() as staging:
         for file in files:
-            print(f"Copying {files} to {dest} ...")
-            shutil.copy(file, dest)
+            name, extension = os.path.splitext(os.path.basename(file))
+            staging.Stage(file, os.path.join(dest, name + suffix + extension))
+
+class Span:
+    """
+    Times a command or a subprocess when profiling, with the cpu time and peak rss of its child processes
+    and the bytes it read, wrote, downloaded and archived. A span adds its totals to its parent span
+    """
+    Current = threading.local()
+    Lock = threading.Lock()
+    Start = time.perf_counter()
+    Threads: dict[int, int] = {}
+
+    def __init__(self, name: str, category: str, parent: "Span | None" = None):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.counters = collections.Counter()
+        self.rss = 0
+
+    def __enter__(self):
+        self.outer = getattr(Span.Current, "span", None)
+        if self.parent == None:
+            self.parent = self.outer
+        Span.Current.span = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        wall = time.perf_counter() - self.start
+        Span.Current.span = self.outer
+        with Span.Lock:
+            if self.parent != None:
+                self.parent.counters.update(self.counters)
+                self.parent.rss = max(self.parent.rss, self.rss)
+            if ProfileSpans != None:
+                thread = Span.Threads.setdefault(threading.get_ident(), len(Span.Threads) + 1)
+                ProfileSpans.append({"name": self.name, "category": self.category, "thread": thread, "start": self.start - Span.Start,
+                    "wall": wall, "rss": self.rss, "failed": etype != None, **{counter: self.counters[counter] for counter in ProfileCounters}})
+
+def CountBytes(counter: str, count: int):
+    span = getattr(Span.Current, "span", None)
+    if ProfileSpans != None and span != None:
+        with Span.Lock:
+            span.counters[counter] += count
+
+def ProcessName(cmds: list[str] | str) -> str:
+    parts = ParseCmds(cmds) if isinstance(cmds, str) else cmds
+    name = " ".join(os.path.basename(part) for part in parts[:3])
+    if "-r" in parts[:-1]:
+        name += f" -r {parts[parts.index('-r') + 1]}"
+    return name
+
+def WaitProcess(proc: subprocess.Popen, span: Span) -> int:
+    """proc.wait(), reaping the child with wait4 when profiling so its own rusage lands on span"""
+    if ProfileSpans == None or resource == None:
+        return proc.wait()
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except ChildProcessError: # reaped by a poll() from another thread
+        return proc.wait()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    with Span.Lock:
+        span.counters["cpu"] += usage.ru_utime + usage.ru_stime
+        span.counters["read"] += usage.ru_inblock * 512
+        span.counters["written"] += usage.ru_oublock * 512
+        span.rss = max(span.rss, usage.ru_maxrss * (1 if OS == "osx" else 1024)) # bytes on macOS, KiB on linux
+    return proc.returncode
+
+def Call(cmds: list[str] | str, **kwargs) -> int:
+    """subprocess.call with a span around the child process"""
+    with Span(ProcessName(cmds), "process") as span:
+        with subprocess.Popen(cmds, **kwargs) as proc:
+            try:
+                return WaitProcess(proc, span)
+            except:
+                proc.kill()
+                raise
+
+def FormatMiB(count: float) -> str:
+    return f"{count / (1024 * 1024):.1f}"
+
+def WriteProfile():
+    """Writes LogsDir/profile.json and LogsDir/profile.trace.json (chrome://tracing, Perfetto) and prints the slowest steps"""
+    os.makedirs(LogsDir, exist_ok=True)
+    spans = sorted(ProfileSpans, key=lambda span: span["start"])
+    profilePath = os.path.join(LogsDir, "profile.json")
+    with open(profilePath, 'w') as file:
+        json.dump({"spans": spans}, file, indent=4)
+    events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": thread, "args": {"name": f"thread {thread}"}} for thread in sorted(set(span["thread"] for span in spans))]
+    for span in spans:
+        events.append({"name": span["name"], "cat": span["category"], "ph": "X", "pid": 1, "tid": span["thread"],
+            "ts": round(span["start"] * 1e6), "dur": round(span["wall"] * 1e6), "args": {key: span[key] for key in ("rss", "failed", *ProfileCounters)}})
+    tracePath = os.path.join(LogsDir, "profile.trace.json")
+    with open(tracePath, 'w') as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    print(f"Profile written to {profilePath} and {tracePath}")
+    print("Slowest steps (MiB):")
+    print(f"{'wall':>9} {'cpu':>9} {'rss':>8} {'read':>9} {'written':>9} {'download':>9} {'archived':>9}  step")
+    for span in sorted(spans, key=lambda span: span["wall"], reverse=True)[:10]:
+        print(f"{span['wall']:>8.1f}s {span['cpu']:>8.1f}s {FormatMiB(span['rss']):>8} {FormatMiB(span['read']):>9} {FormatMiB(span['written']):>9} "
+            f"{FormatMiB(span['downloaded']):>9} {FormatMiB(span['archived']):>9}  [{span['category']}] {span['name']}{' (failed)' if span['failed'] else ''}")
+
+def SetProfile():
+    global ProfileSpans
+    ProfileSpans = []
+
+JobResult = collections.namedtuple('JobResult', ['name', 'status', 'returncode', 'duration', 'log'])
+
+class StatusBoard:
+    """Live status line per job, redrawn in place on a terminal and printed per state change otherwise"""
+    def __init__(self, names: list[str]):
+        self.names = names
+        self.states = {name: "queued" for name in names}
+        self.started: dict[str, float] = {}
+        self.finished: dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.live = sys.stdout.isatty()
+        self.drawn = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.Refresh, daemon=True)
+
+    def __enter__(self):
+        if self.live:
+            self.thread.start()
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.stopped.set()
+        if self.live:
+            self.thread.join()
+            self.Draw()
+
+    def Set(self, name: str, state: str):
+        with self.lock:
+            self.states[name] = state
+            if state == "running":
+                self.started[name] = time.monotonic()
+            elif name in self.started:
+                self.finished[name] = time.monotonic()
+        if self.live:
+            self.Draw()
+        else:
+            print(f"[{name}] {state}")
+
+    def Elapsed(self, name: str) -> float:
+        if name not in self.started:
+            return 0.0
+        return self.finished.get(name, time.monotonic()) - self.started[name]
+
+    def Refresh(self):
+        while not self.stopped.wait(0.5):
+            self.Draw()
+
+    def Draw(self):
+        with self.lock:
+            width = max(len(name) for name in self.names)
+            lines = [f"{name.ljust(width)}  {self.states[name]:<16} {self.Elapsed(name):7.1f}s" for name in self.names]
+            if self.drawn:
+                sys.stdout.write(f"\x1b[{self.drawn}F")
+            for line in lines:
+                sys.stdout.write(f"\x1b[2K{line}\n")
+            sys.stdout.flush()
+            self.drawn = len(lines)
+
+def RunParallel(jobs: dict[str, list[str]], maxWorkers: int, failFast: bool = True) -> list[JobResult]:
+    """Runs each command in a bounded pool, writing its output to LogsDir/<name>.log"""
+    os.makedirs(LogsDir, exist_ok=True)
+    procs: dict[str, subprocess.Popen] = {}
+    procsLock = threading.Lock()
+    aborted = threading.Event()
+    parent = getattr(Span.Current, "span", None)
+
+    def RunJob(name: str, cmds: list[str], board: StatusBoard) -> JobResult:
+        logPath = os.path.join(LogsDir, f"{name}.log")
+        if aborted.is_set():
+            board.Set(name, "skipped")
+            return JobResult(name, "skipped", None, 0.0, logPath)
+        board.Set(name, "running")
+        with open(logPath, 'w') as log, Span(ProcessName(cmds), "process", parent) as span:
+            with procsLock:
+                proc = subprocess.Popen(cmds, stdout=log, stderr=subprocess.STDOUT)
+                procs[name] = proc
+            returncode = WaitProcess(proc, span)
+        if returncode == 0:
+            status = "done"
+        elif aborted.is_set():
+            status = "cancelled"
+        else:
+            status = "failed"
+            if failFast:
+                aborted.set()
+                with procsLock:
+                    for other in procs.values():
+                        if other.poll() is None:
+                            other.terminate()
+        board.Set(name, status if returncode == 0 else f"{status} ({returncode})")
+        return JobResult(name, status, returncode, board.Elapsed(name), logPath)
+
+    with StatusBoard(list(jobs)) as board:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+            futures = [executor.submit(RunJob, name, cmds, board) for name, cmds in jobs.items()]
+            results = [future.result() for future in futures]
+    return results
+
+def PrintSummary(results: list[JobResult]):
+    width = max([len("target")] + [len(result.name) for result in results])
+    print()
+    print(f"{'target'.ljust(width)}  {'status':<10} {'exit':>4} {'time':>9}  log")
+    for result in results:
+        returncode = "" if result.returncode is None else str(result.returncode)
+        print(f"{result.name.ljust(width)}  {result.status:<10} {returncode:>4} {result.duration:8.1f}s  {result.log}")
+    print()
+
+def LoadCacheIndex() -> dict:
+    indexPath = os.path.join(CacheDir, "index.json")
+    index = {"responses": {}, "downloads": {}, "installed": {}}
+    if os.path.isfile(indexPath):
+        with open(indexPath, 'r') as file:
+            index.update(json.load(file))
+    return index
+
+def SaveCacheIndex(index: dict):
+    os.makedirs(CacheDir, exist_ok=True)
+    indexPath = os.path.join(CacheDir, "index.json")
+    with open(indexPath + ".tmp", 'w') as file:
+        json.dump(index, file, indent=4)
+    os.replace(indexPath + ".tmp", indexPath)
+
+def MirrorUrl(url: str) -> str:
+    """Maps https://host/path to <mirror>/host/path so a local http server can stand in for github"""
+    if Mirror == None:
+        return url
+    parts = urllib.parse.urlsplit(url)
+    mirrored = f"{Mirror.rstrip('/')}/{parts.netloc}{parts.path}"
+    return f"{mirrored}?{parts.query}" if parts.query else mirrored
+
+def FileSha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def FetchJson(url: str) -> dict:
+    """Gets json from url, reusing the cached body when the server answers If-None-Match with 304"""
+    index = LoadCacheIndex()
+    cached = index["responses"].get(url)
+    cachedPath = os.path.join(CacheDir, cached["file"]) if cached else None
+    if cachedPath and not os.path.isfile(cachedPath):
+        cached = None
+    if Offline:
+        if cached == None:
+            raise Exception(f"{url} is not cached, cannot continue offline")
+        with open(cachedPath, 'r') as file:
+            return json.load(file)
+
+    request = urllib.request.Request(MirrorUrl(url))
+    if cached and cached.get("etag"):
+        request.add_header("If-None-Match", cached["etag"])
+    try:
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+            etag = response.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            print(f"Not modified: {url}")
+            with open(cachedPath, 'r') as file:
+                return json.load(file)
+        raise
+
+    fileName = os.path.join("responses", hashlib.sha1(url.encode()).hexdigest() + ".json")
+    os.makedirs(os.path.join(CacheDir, "responses"), exist_ok=True)
+    with open(os.path.join(CacheDir, fileName), 'wb') as file:
+        file.write(body)
+    index = LoadCacheIndex()
+    index["responses"][url] = {"etag": etag, "file": fileName}
+    SaveCacheIndex(index)
+    return json.loads(body.decode())
+
+Download = collections.namedtuple('Download', ['path', 'key', 'changed', 'extracted'])
+
+class DownloadStream(io.RawIOBase):
+    """
+    Readable stream over a download that is being appended to partPath
+    The bytes already in partPath are replayed first so everything is hashed once, and a dropped
+    connection is resumed with a Range request
+    """
+    def __init__(self, request: urllib.request.Request, partPath: str, etag: str | None):
+        self.request = request
+        self.partPath = partPath
+        self.etag = etag
+        self.sha = hashlib.sha256()
+        self.offset = os.path.getsize(partPath) if os.path.isfile(partPath) else 0
+        self.replay = open(partPath, 'rb') if self.offset else None
+        self.response = self.Open(restart=True)
+        self.part = open(partPath, 'ab')
+        self.retries = 3
+
+    def Open(self, restart: bool = False):
+        """restart allows a stale part to be replaced by a full response, only before anything has been read"""
+        request = urllib.request.Request(self.request.full_url, headers=dict(self.request.header_items()))
+        if self.offset:
+            request.add_header("Range", f"bytes={self.offset}-")
+            if self.etag:
+                request.add_header("If-Range", self.etag)
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code != 416 or not self.offset:
+                raise
+            # Nothing past the end of the part, it is complete (the size and hash checks still apply)
+            e.close()
+            print("Download already complete")
+            return None
+        if self.offset and response.status != 206 and not restart:
+            # The consumer already has the earlier bytes, keep the part and let the next run start over
+            response.close()
+            raise ConnectionError(f"Server did not resume at {self.offset} bytes (status {response.status})")
+        if self.offset and response.status != 206:
+            # The server sent the whole file again, the part is stale
+            print("Server did not resume, starting over")
+            if self.replay:
+                self.replay.close()
+                self.replay = None
+            self.offset = 0
+            self.sha = hashlib.sha256()
+            open(self.partPath, 'wb').close()
+        elif self.offset:
+            print(f"Resuming at {self.offset} bytes")
+        self.etag = response.headers.get("ETag") or self.etag
+        with open(self.partPath + ".etag", 'w') as file:
+            file.write(self.etag or "")
+        return response
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.replay:
+            count = self.replay.readinto(buffer)
+            if count:
+                self.sha.update(memoryview(buffer)[:count])
+                return count
+            self.replay.close()
+            self.replay = None
+        while True:
+            if self.response == None:
+                return 0
+            try:
+                chunk = self.response.read(len(buffer))
+                if not chunk and self.response.length:
+                    # http.client reports a connection closed before Content-Length as a plain end of data
+                    raise http.client.IncompleteRead(b"", self.response.length)
+                break
+            except (OSError, http.client.HTTPException):
+                if self.retries == 0:
+                    raise
+                self.retries -= 1
+                self.part.flush()
+                self.offset = os.path.getsize(self.partPath)
+                print("Connection dropped, resuming ...")
+                self.response = self.Open()
+        count = len(chunk)
+        buffer[:count] = chunk
+        self.sha.update(chunk)
+        self.part.write(chunk)
+        CountBytes("downloaded", count)
+        return count
+
+    def Drain(self):
+        while self.read(1024 * 1024):
+            pass
+
+    def close(self):
+        if not self.closed:
+            if self.response != None:
+                self.response.close()
+            self.part.close()
+            if self.replay:
+                self.replay.close()
+        super().close()
+
+def DownloadToCache(url: str, key: dict | None = None, extract = None) -> Download:
+    """
+    Downloads url into the cache
+    With a release asset key the cached archive is reused whenever the key matches, otherwise the
+    request is made conditional on the ETag of the cached archive. An interrupted download is resumed
+    from its .part file. extract, if given, reads the archive while it is being downloaded
+    """
+    name = key["name"] if key else os.path.basename(urllib.parse.urlsplit(url).path)
+    index = LoadCacheIndex()
+    cached = index["downloads"].get(url)
+    if cached and not os.path.isfile(os.path.join(CacheDir, cached["file"])):
+        cached = None
+    if cached and (Offline or key != None and cached["key"] == key):
+        print(f"Using cached {name}")
+        return Download(os.path.join(CacheDir, cached["file"]), cached["key"], False, False)
+    if Offline:
+        raise Exception(f"{name} is not cached, cannot continue offline")
+
+    request = urllib.request.Request(MirrorUrl(url))
+    if cached and key == None and cached.get("etag"):
+        request.add_header("If-None-Match", cached["etag"])
+    os.makedirs(os.path.join(CacheDir, "downloads"), exist_ok=True)
+    partPath = os.path.join(CacheDir, "downloads", name + ".part")
+    partEtag = None
+    if os.path.isfile(partPath + ".etag"):
+        with open(partPath + ".etag", 'r') as file:
+            partEtag = file.read() or None
+    if os.path.isfile(partPath) and (key == None or partEtag == None):
+        # Nothing tells which version the part belongs to
+        os.remove(partPath)
+    try:
+        stream = DownloadStream(request, partPath, partEtag)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            print(f"Not modified: {name}")
+            return Download(os.path.join(CacheDir, cached["file"]), cached["key"], False, False)
+        raise
+    with stream:
+        print(f"Downloading {name} ...")
+        if extract != None:
+            try:
+                extract(stream)
+            except (OSError, http.client.HTTPException):
+                raise # keep the part to resume from
+            except Exception:
+                # A corrupt archive or missing members, resuming would only fetch the same bytes again
+                stream.close()
+                os.remove(partPath)
+                raise
+        stream.Drain()
+        digest = stream.sha.hexdigest()
+        etag = stream.etag
+    print("Finished downloading")
+
+    size = os.path.getsize(partPath)
+    if key == None:
+        key = {"name": name, "size": size, "sha256": digest}
+    elif key["sha256"] != None and key["sha256"] != digest or key["size"] != size:
+        os.remove(partPath)
+        raise Exception(f"Download of {name} is corrupt: expected {key['size']} bytes with sha256 {key['sha256']}, got {size} bytes with sha256 {digest}")
+
+    fileName = os.path.join("downloads", f"{digest[:16]}-{name}")
+    os.replace(partPath, os.path.join(CacheDir, fileName))
+    os.remove(partPath + ".etag")
+    if cached and cached["file"] != fileName:
+        os.remove(os.path.join(CacheDir, cached["file"]))
+    index = LoadCacheIndex()
+    index["downloads"][url] = {"key": key, "etag": etag, "file": fileName}
+    SaveCacheIndex(index)
+    return Download(os.path.join(CacheDir, fileName), key, cached == None or cached["key"] != key, extract != None)
+
+def ExtractMembers(archive, archiveName: str, dest: str, members: list[str]) -> list[str]:
+    """
+    Extracts only the files named in members (matched by file name) flat into dest
+    archive is a path or, for tar archives, a stream that is read sequentially
+    """
+    os.makedirs(dest, exist_ok=True)
+    extracted = []
+
+    def Write(source, name: str, executable: bool):
+        path = os.path.join(dest, name)
+        with open(path, 'wb') as file:
+            shutil.copyfileobj(source, file, 1024 * 1024)
+        if executable:
+            os.chmod(path, 0o755)
+        extracted.append(path)
+        print(f"Extracted {name}")
+
+    if isinstance(archive, str) and zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                name = os.path.basename(info.filename)
+                if not info.is_dir() and name in members:
+                    with zip_ref.open(info) as source:
+                        Write(source, name, (info.external_attr >> 16) & 0o111 != 0)
+    else:
+        with (tarfile.open(fileobj=archive, mode="r|*") if not isinstance(archive, str) else tarfile.open(archive)) as tar:
+            for info in tar:
+                name = os.path.basename(info.name)
+                if info.isfile() and name in members:
+                    Write(tar.extractfile(info), name, info.mode & 0o111 != 0)
+                    if len(extracted) == len(members):
+                        break
+    missing = [member for member in members if not os.path.isfile(os.path.join(dest, member))]
+    if missing:
+        raise Exception(f"{archiveName} does not contain {', '.join(missing)}")
+    return extracted
+
+def InstallStaged(staging: str, location: str):
+    """Moves the files extracted into staging over the installed ones once the download is verified"""
+    for name in os.listdir(staging):
+        os.replace(os.path.join(staging, name), os.path.join(location, name))
+    shutil.rmtree(staging)
+
+def AssetKey(asset: dict) -> dict:
+    """Identifies a release asset by name, size and sha256 (the upload id stands in when github has no digest)"""
+    digest = asset.get("digest") or ""
+    return {
+        "name": asset["name"],
+        "size": asset["size"],
+        "sha256": digest[len("sha256:"):] if digest.startswith("sha256:") else None,
+        "id": asset.get("id"),
+    }
+
+def InstalledId(location: str, part: str | None) -> str:
+    installedId = os.path.relpath(location, DepsDir).replace(os.sep, "/")
+    return f"{installedId}:{part}" if part else installedId
+
+def IsInstalled(location: str, key: dict, binaries: list[str], part: str | None = None) -> bool:
+    """Whether the binaries extracted into location came from the asset identified by key"""
+    if any(not os.path.isfile(os.path.join(location, binary)) for binary in binaries):
+        return False
+    return LoadCacheIndex()["installed"].get(InstalledId(location, part)) == key
+
+def SetInstalled(location: str, key: dict, part: str | None = None):
+    index = LoadCacheIndex()
+    index["installed"][InstalledId(location, part)] = key
+    SaveCacheIndex(index)
+
+def SetMirror(url: str):
+    global Mirror
+    Mirror = url
+
+def SetOffline():
+    global Offline
+    Offline = True
 
 #Commands
 def DownloadFFmpeg():
     location = os.path.join(DepsDir, "ffmpeg", OS)
     os.makedirs(location, exist_ok=True)
+    binaries = ["ffmpeg.exe", "ffprobe.exe"] if OS == "win" else ["ffmpeg", "ffprobe"]
 
     if OS == "osx":
         apiurlFFmpeg = "https://evermeet.cx/ffmpeg/get/zip"
         apiurlFFprobe = "https://evermeet.cx/ffmpeg/get/ffprobe/zip"
 
-        print("Downloading ffmpeg ...")
-        urllib.request.urlretrieve(apiurlFFmpeg, os.path.join(location, "dlffmpeg.zip"))
-        print("Extracting ffmpeg ...")
-        with cd(location):
-            with zipfile.ZipFile("dlffmpeg.zip", 'r') as zip_ref:
-                zip_ref.extractall(".")
-            os.remove("dlffmpeg.zip")
-        
-        print("Downloading ffprobe ...")
-        urllib.request.urlretrieve(apiurlFFprobe, os.path.join(location, "dlffprobe.zip"))
-        print("Extracting ffprobe ...")
-        with cd(location):
-            with zipfile.ZipFile("dlffprobe.zip", 'r') as zip_ref:
-                zip_ref.extractall(".")
-            os.remove("dlffprobe.zip")
-        
-        subprocess.call(["chmod", "-R", "777", location])
+        for name, url in (("ffmpeg", apiurlFFmpeg), ("ffprobe", apiurlFFprobe)):
+            download = DownloadToCache(url)
+            if not download.changed and IsInstalled(location, download.key, [name], name):
+                print(f"{name} is up to date")
+                continue
+            print(f"Extracting {name} ...")
+            ExtractMembers(download.path, download.key["name"], location, [name])
+            Call(["chmod", "-R", "777", location])
+            SetInstalled(location, download.key, name)
         return
 
     apiurl = "https://api.github.com/repos/BtbN/FFmpeg-Builds/releases/latest"
-    with urllib.request.urlopen(apiurl) as url:
-        releaseJsonData = json.loads(url.read().decode())
+    releaseJsonData = FetchJson(apiurl)
 
     assets = releaseJsonData["assets"]
     if Architecture == "x64":
@@ -183,25 +1165,21 @@ def DownloadFFmpeg():
     print(f"assetName: {assetName}")
     print(f"releaseDL: {releaseDL}")
 
-    print("Downloading ...")
-    urllib.request.urlretrieve(releaseDL, os.path.join(location, assetName))
-    print("Finished downloading")
-
-    dirName = assetName.split('.')[0]
-
-    print("Extracting ...")
-    with cd(location):
-        if assetName.endswith(".zip"):
-            with zipfile.ZipFile(assetName, 'r') as zip_ref:
-                zip_ref.extractall(".")
-        else:
-            with tarfile.open(assetName) as f:
-                f.extractall('.')
+    key = AssetKey(asset)
+    if IsInstalled(location, key, binaries):
+        print(f"{assetName} is already installed")
+        return
 
-    files = ListFiles(os.path.join(location, dirName, "bin"), exclude='ffplay')
-    CopyFilesProgress(files, location)
-    os.remove(os.path.join(location, assetName))
-    shutil.rmtree(os.path.join(location, dirName))
+    # tar archives are extracted while downloading, zips need their central directory so they wait for the full file
+    staging = os.path.join(location, ".staging")
+    shutil.rmtree(staging, ignore_errors=True)
+    streamed = None if assetName.endswith(".zip") else lambda stream: ExtractMembers(stream, assetName, staging, binaries)
+    download = DownloadToCache(releaseDL, key, streamed)
+    if not download.extracted:
+        print("Extracting ...")
+        ExtractMembers(download.path, assetName, staging, binaries)
+    InstallStaged(staging, location)
+    SetInstalled(location, key)
 
 def DownloadMpv():
     # linux and osx should rely on resolving this dependency path (get mpv through package manager such as homebrew)
@@ -212,8 +1190,7 @@ def DownloadMpv():
     os.makedirs(location, exist_ok=True)
 
     apiurl = "https://api.github.com/repos/shinchiro/mpv-winbuild-cmake/releases/latest"
-    with urllib.request.urlopen(apiurl) as url:
-        releaseJsonData = json.loads(url.read().decode())
+    releaseJsonData = FetchJson(apiurl)
 
     assets = releaseJsonData["assets"]
 
@@ -233,19 +1210,21 @@ def DownloadMpv():
     print(f"assetName: {assetName}")
     print(f"releaseDL: {releaseDL}")
 
-    print("Downloading ...")
-    urllib.request.urlretrieve(releaseDL, os.path.join(location, assetName))
-    print("Finished downloading")
+    key = AssetKey(asset)
+    if IsInstalled(location, key, ["libmpv-2.dll"]):
+        print(f"{assetName} is already installed")
+        return
 
-    dirName = assetName.split('.')[0]
+    download = DownloadToCache(releaseDL, key)
 
+    # 7z is not supported by the standard library, only pull the dll out of the archive
     print("Extracting ...")
-    with cd(location):
-        subprocess.call(["7z", "x", os.path.join(location, assetName), f"-o{dirName}"])
-
-    CopyFilesProgress(os.path.join(location, dirName, "libmpv-2.dll"), location)
-    os.remove(os.path.join(location, assetName))
-    shutil.rmtree(os.path.join(location, dirName))
+    staging = os.path.join(location, ".staging")
+    shutil.rmtree(staging, ignore_errors=True)
+    if Call(["7z", "e", download.path, f"-o{staging}", "-r", "-y", "libmpv-2.dll"]) != 0 or not os.path.isfile(os.path.join(staging, "libmpv-2.dll")):
+        raise Exception(f"Could not extract libmpv-2.dll from {assetName}")
+    InstallStaged(staging, location)
+    SetInstalled(location, key)
 
 def PrintTargetOptions():
     print()
@@ -256,6 +1235,54 @@ def PrintTargetOptions():
 def DeleteBuildDir():
     if os.path.isdir(OutputDir):
         shutil.rmtree(OutputDir)
+    Output().Remove(OutputDir)
+
+def ReplaceFile(path: str, data: bytes):
+    """Writes data next to path and renames it over path, so path is never left half written"""
+    file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", delete=False)
+    try:
+        with file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        shutil.copymode(path, file.name)
+        os.replace(file.name, path)
+    except:
+        os.remove(file.name)
+        raise
+
+def StampData(original: bytes, substitutions: list[tuple[str, str]]) -> bytes:
+    newline = "\r\n" if b"\r\n" in original else "\n"
+    data = original.decode("utf-8").replace("\r\n", "\n")
+    for pattern, replacement in substitutions:
+        data = re.sub(pattern, replacement, data)
+    return data.replace("\n", newline).encode("utf-8")
+
+def StampFiles(stamps: dict[str, list[tuple[str, str]]]):
+    """
+    Applies each file's regex substitutions in one pass and replaces only the files whose content changed,
+    so unchanged files keep their mtime. If a replace fails the files already replaced are restored
+    """
+    changes = {}
+    for path, substitutions in stamps.items():
+        with open(path, 'rb') as file:
+            original = file.read()
+        data = StampData(original, substitutions)
+        if data != original:
+            changes[path] = (original, data)
+    replaced = []
+    try:
+        for path, (original, data) in changes.items():
+            print(f"Stamping {os.path.relpath(path, RepoDir)} ...")
+            ReplaceFile(path, data)
+            replaced.append(path)
+    except:
+        for path in replaced:
+            print(f"Restoring {os.path.relpath(path, RepoDir)} ...")
+            ReplaceFile(path, changes[path][0])
+        raise
+    if len(changes) < len(stamps):
+        print(f"{len(stamps) - len(changes)} file(s) already up to date")
 
 def SetVersion(version: str):
     print(f"Setting version to: '{version}' ...")
@@ -288,37 +1315,37 @@ def SetVersion(version: str):
         VBuild = 0
 
     # Set version for compile targets
+    versionProperties = ""
+    if InjectVersion:
+        versionProperties = f" -p:CvpVersionMajor={VMajor} -p:CvpVersionMinor={VMinor} -p:CvpVersionPatch={VPatch} -p:CvpVersionBuild={VBuild}"
+        if VIdentifier != None:
+            versionProperties += f" -p:CvpVersionIdentifier={VIdentifier}"
     for target in CompileTargets:
-        CompileTargets[target] = CompileTargets[target].replace("-p:AssemblyVersion=1.0.0.0 -p:Version=1.0.0.0", f"-p:AssemblyVersion={VMajor}.{VMinor}.{VPatch}.{VBuild} -p:Version={version}")
+        CompileTargets[target] = CompileTargets[target].replace("-p:AssemblyVersion=1.0.0.0 -p:Version=1.0.0.0", f"-p:AssemblyVersion={VMajor}.{VMinor}.{VPatch}.{VBuild} -p:Version={version}{versionProperties}")
 
     # Set version for the executable
     if VIdentifier == None:
         versionParams = f"{VMajor}, {VMinor}, {VPatch}"
     else:
         versionParams = f"{VMajor}, {VMinor}, {VPatch}, \"{VIdentifier}\", {VBuild}"
-    
-    with cd(os.path.join(RepoDir, "src", "CyberPlayer.Player")):
-        with open("BuildConfig.cs", 'r') as file:
-            buildConfigData = file.read()
-            buildConfigData = re.sub(r'(?<=public static readonly SemanticVersion Version = new\().*(?=\);)', versionParams, buildConfigData)
-        with open("BuildConfig.cs", 'w') as file:
-            file.write(buildConfigData)
-
-    # Set version for osx config
-    with cd(ConfigOsxDir):
-        with open("Info.plist", 'r') as file:
-            plistData = file.read()
-            plistData = re.sub(r"(?<=<key>CFBundleShortVersionString</key>\n        <string>).*?(?=</string>)", version, plistData)
-        with open("Info.plist", 'w') as file:
-            file.write(plistData)
-        
-        with open("distribution.xml", 'r') as file:
-            distData = file.read()
-            distData = re.sub(r"(?<!\?xml version=\")(?<=version=\").*?(?=\")", version, distData)
-            distData = re.sub(r"(?<=versStr=\").*?(?=\")", version, distData)
-            distData = re.sub(r"(?<=hostArchitectures=\").*?(?=\")", platform.machine().lower(), distData)
-        with open("distribution.xml", 'w') as file:
-            file.write(distData)
+
+    stamps = {
+        # Set version for osx config
+        os.path.join(ConfigOsxDir, "Info.plist"): [
+            (r"(?<=<key>CFBundleShortVersionString</key>\n        <string>).*?(?=</string>)", version),
+        ],
+        os.path.join(ConfigOsxDir, "distribution.xml"): [
+            (r"(?<!\?xml version=\")(?<=version=\").*?(?=\")", version),
+            (r"(?<=versStr=\").*?(?=\")", version),
+            (r"(?<=hostArchitectures=\").*?(?=\")", platform.machine().lower()),
+        ],
+    }
+    # With -injectversion the player gets the version from obj/ at build time instead
+    if not InjectVersion:
+        stamps[os.path.join(RepoDir, "src", "CyberPlayer.Player", "BuildConfig.cs")] = [
+            (r'(?<=public static readonly SemanticVersion Version = new\().*(?=\);)', versionParams),
+        ]
+    StampFiles(stamps)
 
 def ResetVersion():
     print(f"Resetting version to default ...")
@@ -338,81 +1365,212 @@ def ResetVersion():
     for target in CompileTargets:
         CompileTargets[target] = re.sub(r'-p:AssemblyVersion=.*', '-p:AssemblyVersion=1.0.0.0 -p:Version=1.0.0.0', CompileTargets[target])
 
-    with cd(os.path.join(RepoDir, "src", "CyberPlayer.Player")):
-        with open("BuildConfig.cs", 'r') as file:
-            data = file.read()
-            data = re.sub(r'public static readonly SemanticVersion Version = new[^;]*', 'public static readonly SemanticVersion Version = new(1, 0, 0)', data)
-        with open("BuildConfig.cs", 'w') as file:
-            file.write(data)
+    StampFiles(DefaultVersionStamps)
+
+# Substitutions -resetversion applies, the fingerprint hashes the stamped files with them applied
+DefaultVersionStamps = {
+    os.path.join(RepoDir, "src", "CyberPlayer.Player", "BuildConfig.cs"): [
+        (r'public static readonly SemanticVersion Version = new[^;]*', 'public static readonly SemanticVersion Version = new(1, 0, 0)'),
+    ],
+    os.path.join(ConfigOsxDir, "Info.plist"): [
+        (r"(?<=<key>CFBundleShortVersionString</key>\n        <string>).*?(?=</string>)", PLIST_VERSION_PLACEHOLDER),
+    ],
+    os.path.join(ConfigOsxDir, "distribution.xml"): [
+        (r"(?<!\?xml version=\")(?<=version=\").*?(?=\")", "1.0.0"),
+        (r"(?<=versStr=\").*?(?=\")", "1.0.0"),
+        (r"(?<=hostArchitectures=\").*?(?=\")", "x86_64,arm64"),
+    ],
+}
 
-    with cd(ConfigOsxDir):
-        with open("Info.plist", 'r') as file:
-            plistData = file.read()
-            plistData = re.sub(r"(?<=<key>CFBundleShortVersionString</key>\n        <string>).*?(?=</string>)", PLIST_VERSION_PLACEHOLDER, plistData)
-        with open("Info.plist", 'w') as file:
-            file.write(plistData)
-
-        with open("distribution.xml", 'r') as file:
-            distData = file.read()
-            distData = re.sub(r"(?<!\?xml version=\")(?<=version=\").*?(?=\")", "1.0.0", distData)
-            distData = re.sub(r"(?<=versStr=\").*?(?=\")", "1.0.0", distData)
-            distData = re.sub(r"(?<=hostArchitectures=\").*?(?=\")", "x86_64,arm64", distData)
-        with open("distribution.xml", 'w') as file:
-            file.write(distData)
+def SetInjectVersion():
+    global InjectVersion
+    InjectVersion = True
+
+def ParseTargets(chosenTargets: str) -> list[str]:
+    if chosenTargets.endswith(";"):
+        chosenTargets = chosenTargets[0:-1]
+    targets = chosenTargets.split(";")
+    for target in targets:
+        if target not in CompileTargets:
+            raise Exception(f"{target} is not a compile target")
+    return targets
+
+def GetTargetOption(target: str, option: str) -> str | None:
+    args = ParseCmds(CompileTargets[target])
+    if option in args:
+        return args[args.index(option) + 1]
+    return None
+
+def GetVersionProperties(target: str) -> list[str]:
+    return [arg for arg in ParseCmds(CompileTargets[target]) if arg.startswith("-p:")]
+
+def CreatePublishCmds(target: str) -> list[str]:
+    return ParseCmds(f"dotnet publish \"{PlayerCsproj}\" {CompileTargets[target]}") + WarmBuildArgs
+
+def HasLockedRids(csproj: str, rids: list[str]) -> bool:
+    """--locked-mode fails unless the lock file's rid targets (net8.0/<rid>) are exactly the rids restored"""
+    lockFile = os.path.join(os.path.dirname(csproj), "packages.lock.json")
+    if not os.path.isfile(lockFile):
+        return False
+    with open(lockFile, 'r', encoding="utf-8-sig") as file:
+        lockedRids = {target.split("/", 1)[1] for target in json.load(file)["dependencies"] if "/" in target}
+    if lockedRids != set(rids):
+        print(f"{lockFile} is locked for {', '.join(sorted(lockedRids)) or 'portable'}, restoring without --locked-mode")
+        return False
+    return True
+
+def RestoreProject(csproj: str, rids: list[str], configuration: str, properties: list[str] = []):
+    """
+    Restores every rid in one go so the following publishes can run with --no-restore
+    The configuration has to match the publishes, package references can depend on it (Avalonia.Diagnostics is Debug only)
+    """
+    global RestoreSeconds
+    global RestoreCount
+    print(f"Restoring {os.path.basename(csproj)} ({configuration}) for {', '.join(rids) or 'portable'} ...")
+    cmds = ["dotnet", "restore", csproj, f"-p:Configuration={configuration}", *properties]
+    if rids:
+        cmds.append(f"-p:RuntimeIdentifiers={'%3B'.join(rids)}")
+    if HasLockedRids(csproj, rids):
+        cmds.append("--locked-mode")
+    if RestoreOnce:
+        cmds += WarmBuildArgs
+    start = time.monotonic()
+    if Call(cmds) != 0:
+        raise Exception(f"Restore of {csproj} failed")
+    RestoreSeconds += time.monotonic() - start
+    RestoreCount += 1
+
+def RestoreTargets(targets: list[str], configuration: str):
+    rids = [rid for rid in (GetTargetOption(target, "-r") for target in targets) if rid != None]
+    properties = ["-p:SelfContained=true"] if any(GetTargetOption(target, "--sc") == "true" for target in targets) else []
+    RestoreProject(PlayerCsproj, rids, configuration, properties)
+
+# Concurrent publishes of one project race on the outputs of the (rid agnostic) project references,
+# so build the references once per configuration up front
+def PrepareParallelCompile(targets: list[str]):
+    configurations = {}
+    for target in targets:
+        configurations.setdefault(GetTargetOption(target, "-c"), GetVersionProperties(target))
+    for configuration, properties in configurations.items():
+        print(f"Building project references ({configuration}) ...")
+        if Call(["dotnet", "build", PlayerCsproj, "--no-restore", "-c", configuration, "-t:ResolveProjectReferences", *properties, *WarmBuildArgs]) != 0:
+            raise Exception("Building project references failed")
+
+def CompileParallel(targets: list[str]):
+    PrepareParallelCompile(targets)
+    jobs = {}
+    for target in targets:
+        os.makedirs(os.path.join(OutputDir, target), exist_ok=True)
+        jobs[target] = CreatePublishCmds(target) + ["--no-restore", "-p:BuildProjectReferences=false"]
+    SkipRestores(len(targets))
+    print(f"Publishing {len(targets)} target(s) with {Jobs} job(s), logs in {LogsDir}")
+    results = RunParallel(jobs, Jobs, FailFast)
+    PrintSummary(results)
+    failed = [result.name for result in results if result.status != "done"]
+    if failed:
+        raise Exception(f"Compile failed for: {', '.join(failed)}")
 
 def Compile(chosenTargets: str):
-    if ";" in chosenTargets:
-        if chosenTargets.endswith(";"):
-            chosenTargets = chosenTargets[0:-1]
-        chosenTargetsList = chosenTargets.split(";")
-        for target in chosenTargetsList:
-            os.makedirs(os.path.join(OutputDir, target), exist_ok=True)
-            cmds = f"dotnet publish \"{os.path.join(RepoDir, 'src', 'CyberPlayer.Player', 'CyberPlayer.Player.csproj')}\" {CompileTargets[target]}"
-            subprocess.call(ParseCmds(cmds))
-    else:
-        os.makedirs(os.path.join(OutputDir, chosenTargets), exist_ok=True)
-        cmds = f"dotnet publish \"{os.path.join(RepoDir, 'src', 'CyberPlayer.Player', 'CyberPlayer.Player.csproj')}\" {CompileTargets[chosenTargets]}"
-        subprocess.call(ParseCmds(cmds))
+    targets = ParseTargets(chosenTargets)
+    try:
+        PublishTargets(targets)
+    finally:
+        for target in targets:
+            Output().Refresh(os.path.join(OutputDir, target))
+
+def PublishTargets(targets: list[str]):
+    # The project has one obj/project.assets.json, so each configuration is restored and published in turn
+    configurations = {}
+    for target in targets:
+        configurations.setdefault(GetTargetOption(target, "-c"), []).append(target)
+    failures = []
+    for configuration, group in configurations.items():
+        try:
+            PublishConfiguration(group, configuration)
+        except Exception as e:
+            if FailFast:
+                raise
+            print(e)
+            failures.append(str(e))
+    if failures:
+        raise Exception("; ".join(failures))
+
+def PublishConfiguration(targets: list[str], configuration: str):
+    # Parallel publishes always need the shared restore, they would race on obj/project.assets.json otherwise
+    if Jobs != None or RestoreOnce:
+        RestoreTargets(targets, configuration)
+    if Jobs != None:
+        CompileParallel(targets)
+        return
+    for target in targets:
+        os.makedirs(os.path.join(OutputDir, target), exist_ok=True)
+        if RestoreOnce:
+            returncode = Call(CreatePublishCmds(target) + ["--no-restore"])
+            SkipRestores(1)
+        else:
+            returncode = Call(CreatePublishCmds(target))
+        if returncode != 0:
+            raise Exception(f"Compile failed for: {target}")
+
+def SetJobs(jobs: str):
+    global Jobs
+    Jobs = int(jobs)
+    if Jobs < 1:
+        raise Exception("Jobs must be at least 1")
+
+def SetKeepGoing():
+    global FailFast
+    FailFast = False
+
+def SetRestoreOnce():
+    global RestoreOnce
+    RestoreOnce = True
+    WarmBuildArgs.extend(["-nodeReuse:true", "-p:UseSharedCompilation=true"])
+    os.environ["MSBUILDDISABLENODEREUSE"] = "0"
+    os.environ["DOTNET_CLI_TELEMETRY_OPTOUT"] = "1"
+    os.environ["DOTNET_NOLOGO"] = "1"
+
+def SkipRestores(count: int):
+    global SkippedRestoreCount
+    SkippedRestoreCount += count
+
+def ShutdownBuildServers():
+    print("Shutting down build servers ...")
+    Call(["dotnet", "build-server", "shutdown"])
+    if RestoreCount == 0:
+        return
+    average = RestoreSeconds / RestoreCount
+    print(f"Restore once: {RestoreCount} restore(s) took {RestoreSeconds:.1f}s and replaced {SkippedRestoreCount} implicit restore(s)")
+    # The implicit restores weren't run, so this prices each one like the multi-rid restores above
+    print(f"Rough estimate, not measured: up to {SkippedRestoreCount * average - RestoreSeconds:.1f}s saved if an implicit restore takes {average:.1f}s like these")
 
 def CopyFFmpeg():
-    for build in ListDirs(OutputDir):
+    for build in Output().Builds():
         ffmpegPath = os.path.join(build, "ffmpeg")
-        if "win" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "win")), ffmpegPath)
-        elif "linux" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "linux")), ffmpegPath)
-        elif "osx" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "osx")), ffmpegPath)
-        elif "portable" in os.path.basename(build):
+        buildOS = TargetPlatform(os.path.basename(build))
+        if buildOS in ("win", "linux", "osx"):
+            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", buildOS)), ffmpegPath)
+        elif buildOS == "portable":
             CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "win")), ffmpegPath)
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "linux")), ffmpegPath)
-            with cd(ffmpegPath):
-                os.rename("ffmpeg", "ffmpeg-linux")
-                os.rename("ffprobe", "ffprobe-linux")
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "osx")), ffmpegPath)
-            with cd(ffmpegPath):
-                os.rename("ffmpeg", "ffmpeg-osx")
-                os.rename("ffprobe", "ffprobe-osx")
+            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "linux")), ffmpegPath, "-linux")
+            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "ffmpeg", "osx")), ffmpegPath, "-osx")
 
 def CopyMediaInfo():
-    for build in ListDirs(OutputDir):
+    for build in Output().Builds():
         mediaInfoPath = os.path.join(build, "mediainfo")
-        if "win" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "mediainfo", "win")), mediaInfoPath)
-        elif "linux" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "mediainfo", "linux")), mediaInfoPath)
-        elif "osx" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "mediainfo", "osx")), mediaInfoPath)
+        buildOS = TargetPlatform(os.path.basename(build))
+        if buildOS in ("win", "linux", "osx"):
+            CopyFilesProgress(ListFiles(os.path.join(DepsDir, "mediainfo", buildOS)), mediaInfoPath)
 
 def RemovePDBs():
-    for file in ListFiles(OutputDir, recursive=True):
-        if file.endswith(".pdb"):
-            os.remove(file)
-        elif file.endswith(".dbg"):
-            os.remove(file)
-    for dir in ListDirs(OutputDir, recursive=True):
-        if dir.endswith(".dsym"):
+    output = Output()
+    for file in output.Files(extensions=(".pdb", ".dbg")):
+        os.remove(file.path)
+        output.Remove(file.path)
+    for dir in output.Dirs(extensions=(".dsym",)):
+        if os.path.isdir(dir):
             shutil.rmtree(dir)
+        output.Remove(dir)
 
 #Make lib dir courtesy of https://github.com/nulastudio/NetBeauty2
 def MakeLibraryDir(chosenTargets: str):
@@ -421,9 +1579,9 @@ def MakeLibraryDir(chosenTargets: str):
             if compileTarget == "sc" or compileTarget == "all":
                 continue
             if "--sc true" in CompileTargets[compileTarget]:
-                    subprocess.call(f"nbeauty2 --usepatch --loglevel Detail --hiddens \"hostfxr;hostpolicy;*.deps.json;*.runtimeconfig*.json\" {os.path.join(OutputDir, compileTarget)} lib \"libmpv-2.dll;\"")
+                    Call(f"nbeauty2 --usepatch --loglevel Detail --hiddens \"hostfxr;hostpolicy;*.deps.json;*.runtimeconfig*.json\" {os.path.join(OutputDir, compileTarget)} lib \"libmpv-2.dll;\"")
             else:
-                subprocess.call(f"nbeauty2 --loglevel Detail {os.path.join(OutputDir, compileTarget)} lib \"libmpv-2.dll;\"")
+                Call(f"nbeauty2 --loglevel Detail {os.path.join(OutputDir, compileTarget)} lib \"libmpv-2.dll;\"")
     elif ";" in chosenTargets:
         chosenTargetsList = chosenTargets.split(";")
         if "all" in chosenTargetsList:
@@ -435,42 +1593,71 @@ def MakeLibraryDir(chosenTargets: str):
                     chosenTargetsList.append(target)
         for target in chosenTargetsList:
             if "--sc true" in CompileTargets[target]:
-                subprocess.call(f"nbeauty2 --usepatch --loglevel Detail --hiddens \"hostfxr;hostpolicy;*.deps.json;*.runtimeconfig*.json\" {os.path.join(OutputDir, target)} lib \"libmpv-2.dll;\"")
+                Call(f"nbeauty2 --usepatch --loglevel Detail --hiddens \"hostfxr;hostpolicy;*.deps.json;*.runtimeconfig*.json\" {os.path.join(OutputDir, target)} lib \"libmpv-2.dll;\"")
             else:
-                subprocess.call(f"nbeauty2 --loglevel Detail {os.path.join(OutputDir, target)} lib \"libmpv-2.dll;\"")
+                Call(f"nbeauty2 --loglevel Detail {os.path.join(OutputDir, target)} lib \"libmpv-2.dll;\"")
     else:
         if "--sc true" in CompileTargets[chosenTargets]:
-                subprocess.call(f"nbeauty2 --usepatch --loglevel Detail --hiddens \"hostfxr;hostpolicy;*.deps.json;*.runtimeconfig*.json\" {os.path.join(OutputDir, chosenTargets)} lib \"libmpv-2.dll;\"")
+                Call(f"nbeauty2 --usepatch --loglevel Detail --hiddens \"hostfxr;hostpolicy;*.deps.json;*.runtimeconfig*.json\" {os.path.join(OutputDir, chosenTargets)} lib \"libmpv-2.dll;\"")
         else:
-            subprocess.call(f"nbeauty2 --loglevel Detail {os.path.join(OutputDir, chosenTargets)} lib \"libmpv-2.dll;\"")
+            Call(f"nbeauty2 --loglevel Detail {os.path.join(OutputDir, chosenTargets)} lib \"libmpv-2.dll;\"")
+    Output().Refresh(OutputDir) # nbeauty2 moves the dlls into lib
 
 #Copy licenses, readme, etc.
 def CopyMDs():
     mdFiles = ListFiles(DocsDir, filter=".md")
-    for build in ListDirs(OutputDir):
+    for build in Output().Builds():
         CopyFilesProgress(mdFiles, build)
 
 #Copy updater
 def CopyUpdater():
     updaterBuildPath = os.path.join(DepsDir, "cyber-lib", "build")
-    for build in ListDirs(OutputDir):
-        if "win-x64" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(f"{os.path.join(updaterBuildPath, 'win-x64')}", exclude=".pdb"), os.path.join(build, "updater"))
-        elif "linux-x64" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(f"{os.path.join(updaterBuildPath, 'linux-x64')}", exclude=".pdb"), os.path.join(build, "updater"))
-        elif "osx-x64" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(f"{os.path.join(updaterBuildPath, 'osx-x64')}", exclude=".pdb"), os.path.join(build, "updater"))
-        elif "osx-arm64" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(f"{os.path.join(updaterBuildPath, 'osx-arm64')}", exclude=".pdb"), os.path.join(build, "updater"))
-        elif "portable" in os.path.basename(build):
-            CopyFilesProgress(ListFiles(f"{os.path.join(updaterBuildPath, 'portable')}", exclude=".pdb"), os.path.join(build, "updater"))
+    for build in Output().Builds():
+        target = os.path.basename(build)
+        rid = next((rid for rid in ("win-x64", "linux-x64", "osx-x64", "osx-arm64") if target.startswith(rid)), None)
+        if rid == None and TargetPlatform(target) == "portable":
+            rid = "portable"
+        if rid != None:
+            CopyFilesProgress(ListFiles(os.path.join(updaterBuildPath, rid), exclude=".pdb"), os.path.join(build, "updater"))
 
 #Zip
 def ZipBuilds():
-    with cd(OutputDir):
-        for build in ListDirs(OutputDir):
-            print(f"Zipping {build} ...")
-            shutil.make_archive(build, "zip", build)
+    WriteArchives({build + ".zip": DirLayout(build) for build in Output().Builds()})
+
+def BuiltTarget(target: str) -> str:
+    build = os.path.join(OutputDir, target)
+    if build not in Output().Builds():
+        raise Exception(f"{target} has not been built, there is no {build}")
+    return build
+
+def TarBuilds(chosenTargets: str):
+    WriteArchives({os.path.join(OutputDir, f"{target}.tar.gz"): DirLayout(BuiltTarget(target), target) for target in ParseTargets(chosenTargets)})
+
+# Writes <target>.tar.gz and the CVP-<target>-setup.tar.gz installer layout in one pass
+def CreateLinuxSetup(target: str):
+    configDir = os.path.join(BuildDir, "setup-config-linux")
+    iconsDir = os.path.join(RepoDir, "src", "CyberPlayer.Player", "Assets", "Logo", "cyber-logo-sunset.iconset")
+    build = BuiltTarget(target)
+    stage = f"CVP-{target}"
+    setup = DirLayout(build, f"{stage}/CyberVideoPlayer") + DirLayout(iconsDir, f"{stage}/assets") + [
+        ArchiveEntry(stage, None),
+        ArchiveEntry(f"{stage}/assets/cybervideoplayer.desktop", os.path.join(configDir, "cybervideoplayer.desktop")),
+        ArchiveEntry(f"{stage}/install.sh", os.path.join(configDir, "install.sh"), 0o755),
+    ]
+    WriteArchives({
+        os.path.join(OutputDir, f"{target}.tar.gz"): DirLayout(build, target),
+        os.path.join(OutputDir, f"{stage}-setup.tar.gz"): setup,
+    })
+
+def EnableHardlinks():
+    global HardlinkStaging
+    HardlinkStaging = True
+
+def SetCompressionLevel(level: str):
+    global CompressionLevel
+    CompressionLevel = int(level)
+    if CompressionLevel < 0 or CompressionLevel > 9:
+        raise Exception("Compression level must be between 0 and 9")
 
 def DeleteBinReleaseDirs():
     dirs = ListDirs(os.path.join(RepoDir, "src", "CyberPlayer.Player", "bin"))
@@ -479,43 +1666,164 @@ def DeleteBinReleaseDirs():
             shutil.rmtree(dir)
 
 def DeleteBuildDirs():
-    for build in ListDirs(OutputDir):
+    output = Output()
+    for build in output.Builds():
         shutil.rmtree(build)
+        output.Remove(build)
 
 def CopyMpvLib():
-    for build in ListDirs(OutputDir):
-        if "win" in os.path.basename(build):
+    for build in Output().Builds():
+        buildOS = TargetPlatform(os.path.basename(build))
+        if buildOS == "win":
             CopyFilesProgress(os.path.join(DepsDir, "mpv", "win", "libmpv-2.dll"), build)
-        elif "linux" in os.path.basename(build):
+        elif buildOS == "linux":
             CopyFilesProgress(os.path.join(DepsDir, "mpv", "linux-2.1.0", "libmpv.so.2"), build)
-        elif "osx-arm64" in os.path.basename(build):
+        elif os.path.basename(build).startswith("osx-arm64"):
             CopyFilesProgress(os.path.join(DepsDir, "mpv", "osx-arm64-2.1.0", "libmpv.2.dylib"), build)
-        elif "portable" in os.path.basename(build):
+        elif buildOS == "portable":
             CopyFilesProgress(os.path.join(DepsDir, "mpv", "win", "libmpv-2.dll"), build)
             CopyFilesProgress(os.path.join(DepsDir, "mpv", "linux-2.1.0", "libmpv.so.2"), build)
             #CopyFilesProgress(os.path.join(DepsDir, "mpv", "osx-2.1.0", "libmpv.2.dylib"), build)
 
+def UpdaterRids(builds: list[str]) -> list[str]:
+    """The updater rids needed by the builds, in a fixed order"""
+    rids = []
+    for rid in ("win-x64", "linux-x64", "osx-x64", "osx-arm64"):
+        if any(os.path.basename(build).startswith(rid) for build in builds):
+            rids.append(rid)
+    return rids
+
 # Call after Compile
 def BuildUpdater():
     csproj = os.path.join(DepsDir, "cyber-lib", "UpdaterAvalonia", "UpdaterAvalonia.csproj")
     buildDir = os.path.join(DepsDir, "cyber-lib", "build")
-    for build in ListDirs(OutputDir):
-        if "win-x64" in os.path.basename(build):
-            subprocess.call(["dotnet", "publish", csproj, "-o", os.path.join(buildDir, "win-x64"), "-r", "win-x64", "-p:PublishSingleFile=true", "-p:PublishTrimmed=true", "-c", "release", "--sc", "true"])
-        elif "linux-x64" in os.path.basename(build):
-            subprocess.call(["dotnet", "publish", csproj, "-o", os.path.join(buildDir, "linux-x64"), "-r", "linux-x64", "-p:PublishSingleFile=true", "-p:PublishTrimmed=true", "-c", "release", "--sc", "true"])
-        elif "osx-x64" in os.path.basename(build):
-            subprocess.call(["dotnet", "publish", csproj, "-o", os.path.join(buildDir, "osx-x64"), "-r", "osx-x64", "-p:PublishSingleFile=true", "-p:PublishTrimmed=true", "-c", "release", "--sc", "true"])
-        elif "osx-arm64" in os.path.basename(build):
-            subprocess.call(["dotnet", "publish", csproj, "-o", os.path.join(buildDir, "osx-arm64"), "-r", "osx-arm64", "-p:PublishSingleFile=true", "-p:PublishTrimmed=true", "-c", "release", "--sc", "true"])
+    properties = ["-p:PublishSingleFile=true", "-p:PublishTrimmed=true"]
+    rids = UpdaterRids(Output().Builds())
+    if RestoreOnce and rids:
+        RestoreProject(csproj, rids, "release", properties + ["-p:SelfContained=true"])
+    for rid in rids:
+        cmds = ["dotnet", "publish", csproj, "-o", os.path.join(buildDir, rid), "-r", rid, *properties, "-c", "release", "--sc", "true"]
+        if RestoreOnce:
+            cmds += ["--no-restore", *WarmBuildArgs]
+            SkipRestores(1)
+        if Call(cmds) != 0:
+            raise Exception(f"Updater build failed for: {rid}")
 
 # Call after specifying version or default of 1.0.0 will be used
 def CreateWindowsInstaller():
     setupScriptPath = os.path.join(ConfigWinDir, "win-setup.iss")
     if Version == None:
-        subprocess.call(["iscc", setupScriptPath])
+        Call(["iscc", setupScriptPath])
     else:
-        subprocess.call(["iscc", f"-DMyAppVersion={VMajor}.{VMinor}.{VPatch}.{VBuild}", setupScriptPath])
+        Call(["iscc", f"-DMyAppVersion={VMajor}.{VMinor}.{VPatch}.{VBuild}", setupScriptPath])
+    Output().Refresh(os.path.join(OutputDir, "CVP-win-x64-setup.exe"))
+
+ArtifactCategories = ("managed", "native", "ffmpeg", "mediainfo", "updater", "debug", "other")
+SizeBudgets: dict[str, float] | None = None # MiB by target, target/category, */category or duplicates
+
+def IsManagedAssembly(path: str) -> bool:
+    """A PE file with a CLI header (data directory 14) is a .NET assembly, otherwise a native dll"""
+    with open(path, 'rb') as file:
+        header = file.read(4096)
+    if len(header) < 0x40 or header[:2] != b"MZ":
+        return False
+    optional = struct.unpack_from("<I", header, 0x3c)[0] + 24
+    if optional + 2 > len(header) or header[optional - 24:optional - 20] != b"PE\0\0":
+        return False
+    pe32Plus = struct.unpack_from("<H", header, optional)[0] == 0x20b
+    countOffset = optional + (108 if pe32Plus else 92)
+    clrOffset = countOffset + 4 + 14 * 8
+    if clrOffset + 8 > len(header) or struct.unpack_from("<I", header, countOffset)[0] <= 14:
+        return False
+    return struct.unpack_from("<II", header, clrOffset) != (0, 0)
+
+def ArtifactCategory(file: IndexEntry) -> str:
+    parts = file.name.split(os.sep)[1:]
+    name = parts[-1].lower()
+    if len(parts) > 1 and parts[0] in ("ffmpeg", "mediainfo", "updater"):
+        return parts[0]
+    if name.endswith((".pdb", ".dbg")) or any(part.lower().endswith(".dsym") for part in parts[:-1]):
+        return "debug"
+    if name.endswith((".dll", ".exe")) and IsManagedAssembly(file.path):
+        return "managed"
+    if name.endswith((".dll", ".so", ".dylib")) or ".so." in name:
+        return "native"
+    return "other"
+
+def FindDuplicates(files: list[IndexEntry]) -> list[list[IndexEntry]]:
+    """Groups of files with the same content in more than one target, only files with a size in common get hashed"""
+    bySize = collections.defaultdict(list)
+    for file in files:
+        if file.size > 0:
+            bySize[file.size].append(file)
+    candidates = [file for group in bySize.values() if len({file.target for file in group}) > 1 for file in group]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=Jobs or os.cpu_count() or 1) as executor:
+        hashes = list(executor.map(FileSha256, [file.path for file in candidates]))
+    byHash = collections.defaultdict(list)
+    for file, sha256 in zip(candidates, hashes):
+        byHash[sha256].append(file)
+    duplicates = [group for group in byHash.values() if len({file.target for file in group}) > 1]
+    return sorted(duplicates, key=lambda group: group[0].size * (len(group) - 1), reverse=True)
+
+def CheckBudgets(sizes: dict[str, collections.Counter], wasted: int) -> list[str]:
+    failures = []
+    for key, budget in SizeBudgets.items():
+        actual = {}
+        if key == "duplicates":
+            actual[key] = wasted
+        else:
+            pattern, _, category = key.partition("/")
+            if category and category not in ArtifactCategories:
+                raise Exception(f"{key}: {category} is not one of {', '.join(ArtifactCategories)}")
+            for target in sizes:
+                if pattern in ("*", target):
+                    actual[f"{target}/{category}" if category else target] = sizes[target][category] if category else sum(sizes[target].values())
+        for name, size in actual.items():
+            if size > budget * 1024 * 1024:
+                failures.append(f"{name} is {FormatMiB(size)} MiB, over its budget of {budget} MiB")
+    return failures
+
+def ArtifactReport():
+    """Sizes per target and category, files identical across targets and, with -budgets, the size budgets"""
+    files = [file for file in Output().Files() if file.target != None]
+    sizes = {build: collections.Counter() for build in (os.path.basename(build) for build in Output().Builds())}
+    for file in files:
+        sizes[file.target][ArtifactCategory(file)] += file.size
+
+    print("Artifact sizes (MiB):")
+    print(f"{'target':<12} {'total':>9}" + "".join(f" {category:>9}" for category in ArtifactCategories))
+    for target, categories in sizes.items():
+        print(f"{target:<12} {FormatMiB(sum(categories.values())):>9}" + "".join(f" {FormatMiB(categories[category]):>9}" for category in ArtifactCategories))
+
+    duplicates = FindDuplicates(files)
+    wasted = sum(group[0].size * (len(group) - 1) for group in duplicates)
+    shared = collections.Counter()
+    for group in duplicates:
+        shared[", ".join(sorted({file.target for file in group}))] += group[0].size * (len(group) - 1)
+    print(f"{len(duplicates)} file(s) identical across targets, {FormatMiB(wasted)} MiB in extra copies")
+    for targets, size in shared.most_common():
+        print(f"    {FormatMiB(size):>9} MiB shared by {targets}")
+    for group in duplicates[:20]:
+        print(f"    {FormatMiB(group[0].size):>9} MiB x{len(group)} {', '.join(file.name for file in group)}")
+
+    failures = CheckBudgets(sizes, wasted) if SizeBudgets != None else []
+    os.makedirs(LogsDir, exist_ok=True)
+    with open(os.path.join(LogsDir, "artifacts.json"), 'w') as file:
+        json.dump({
+            "sizes": {target: {"total": sum(categories.values()), **{category: categories[category] for category in ArtifactCategories}} for target, categories in sizes.items()},
+            "duplicates": [{"size": group[0].size, "files": [file.name.replace(os.sep, "/") for file in group]} for group in duplicates],
+            "wasted": wasted,
+            "budgetFailures": failures,
+        }, file, indent=4)
+    for failure in failures:
+        print(f"Budget exceeded: {failure}")
+    if failures:
+        raise Exception(f"{len(failures)} size budget(s) exceeded")
+
+def SetSizeBudgets(path: str):
+    global SizeBudgets
+    with open(path, 'r') as file:
+        SizeBudgets = json.load(file)
 
 def DocsToHtml(dest: str):
     import markdown
@@ -529,54 +1837,297 @@ def DocsToHtml(dest: str):
             output_file.write(html)
     #markdown.markdownFromFile(input=md, output=os.path.join(dest, os.path.basename(md).split('.')[0] + ".html"))
 
-Command = collections.namedtuple('Command', ['description', 'function', 'hasParam'])
+# Paths each command reads (inputs) and writes (outputs), given its param. Two commands that touch the
+# same paths keep the order they were typed in, everything else may run concurrently. Commands with a
+# fingerprint (the artifacts they produce) are skipped when their inputs, param and version are unchanged
+# and those artifacts exist.
+# Options only change settings and are applied before any other command.
+Command = collections.namedtuple('Command', ['description', 'function', 'hasParam', 'inputs', 'outputs', 'fingerprint', 'option'], defaults=[None, None, None, False])
+Task = collections.namedtuple('Task', ['name', 'command', 'param'])
+
+PlayerDir = os.path.join(RepoDir, "src", "CyberPlayer.Player")
+CyberLibDir = os.path.join(DepsDir, "cyber-lib")
+UpdaterBuildDir = os.path.join(CyberLibDir, "build")
+TaskStatePath = os.path.join(BuildDir, ".taskstate.json")
+TaskStateLock = threading.Lock()
+DryRun = False
+# Build output inside an input (deps/cyber-lib/build), left out of the fingerprint so it doesn't change after each run
+ArtifactDirs = {os.path.normcase(os.path.abspath(UpdaterBuildDir))}
+PlannedTargets: list[str] = []
+
+def SetDryRun():
+    global DryRun
+    DryRun = True
+
+def PlannedBuilds() -> list[str]:
+    """Build dirs that exist now or will be created by a compile earlier in the command line"""
+    builds = Output().Builds()
+    for target in PlannedTargets:
+        if os.path.join(OutputDir, target) not in builds:
+            builds.append(os.path.join(OutputDir, target))
+    return builds
+
+def ParamTargets(chosenTargets: str) -> list[str]:
+    targets = []
+    for target in chosenTargets.split(";"):
+        if target == "all" or target == "sc":
+            targets += [name for name in CompileTargets if target == "all" or "--sc true" in CompileTargets[name]]
+        elif target:
+            targets.append(target)
+    return targets
+
+def InBuilds(*names: str):
+    return lambda param: [os.path.join(build, name) for build in PlannedBuilds() for name in names]
 
 Commands = {
-    "del": Command("Deletes the build directory", DeleteBuildDir, False),
-    "delbinrel": Command("Deletes the dirs with 'release' in them in the bin folder", DeleteBinReleaseDirs, False),
-    "delbuilddirs": Command("Deletes the dirs in the build folder", DeleteBuildDirs, False),
-    "version": Command("Set the version number when compiling", SetVersion, "Enter version number: "), #version arg
-    "resetversion": Command("Resets the version to 1.0.0.0", ResetVersion, False),
-    "compile": Command("Compiles for the target platform", Compile, "Enter a compile target: "), #compiletarget arg
-    "buildupdater" : Command("Calls the updater build script", BuildUpdater, False),
-    "rmpdbs": Command("Remove all pdb files", RemovePDBs, False),
-    "lib": Command("Makes a library directory for dlls", MakeLibraryDir, "Enter a compile target: "), #compiletarget/s arg
-    "dlffmpeg": Command("Downloads ffmpeg binaries from their recommended sources", DownloadFFmpeg, False),
-    "dlmpv": Command("Downloads mpv binaries from their recommended sources (only Windows currently)", DownloadMpv, False),
-    "cpymds": Command("Copy all markdown files from working directory", CopyMDs, False),
-    "cpyupdater": Command("Copy updater to each build", CopyUpdater, False),
-    "cpyffmpeg": Command("Copy ffmpeg executables to builds", CopyFFmpeg, False),
-    "cpympv": Command("Copy libmpv to builds", CopyMpvLib, False),
-    "cpymediainfo": Command("Copy mediainfo executables to builds", CopyMediaInfo, False),
-    "zip": Command("Zip each build", ZipBuilds, False),
-    "winpkg": Command("Creates a windows installer with innosetup", CreateWindowsInstaller, False),
-    "docstohtml": Command("Converts all .md doc files to .html format", DocsToHtml, True)
+    "del": Command("Deletes the build directory", DeleteBuildDir, False,
+        outputs=lambda param: [OutputDir]),
+    "delbinrel": Command("Deletes the dirs with 'release' in them in the bin folder", DeleteBinReleaseDirs, False,
+        outputs=lambda param: [os.path.join(PlayerDir, "bin")]),
+    "delbuilddirs": Command("Deletes the dirs in the build folder", DeleteBuildDirs, False,
+        outputs=lambda param: [OutputDir]),
+    "version": Command("Set the version number when compiling", SetVersion, "Enter version number: ", #version arg
+        outputs=lambda param: [RepoDir]),
+    "resetversion": Command("Resets the version to 1.0.0.0", ResetVersion, False,
+        outputs=lambda param: [RepoDir]),
+    "injectversion": Command("Pass the version to the player as msbuild properties (obj/.../BuildVersion.g.cs) instead of stamping BuildConfig.cs", SetInjectVersion, False, option=True),
+    "compile": Command("Compiles for the target platform", Compile, "Enter a compile target: ", #compiletarget arg
+        inputs=lambda param: [os.path.join(RepoDir, "src"), os.path.join(CyberLibDir, "Common Libraries"), os.path.join(RepoDir, "global.json")],
+        outputs=lambda param: [os.path.join(OutputDir, target) for target in ParamTargets(param)] + [os.path.join(CyberLibDir, "Common Libraries")],
+        fingerprint=lambda param: [os.path.join(OutputDir, target) for target in ParamTargets(param)]),
+    "jobs": Command("Run this many jobs in parallel: compile targets, archive chunks and independent commands", SetJobs, "Enter number of jobs: ", option=True), #jobs arg
+    "restoreonce": Command("Restore once for all targets, publish without restoring and keep build servers warm", SetRestoreOnce, False, option=True),
+    "keepgoing": Command("Keep publishing the other targets when a parallel compile target fails", SetKeepGoing, False, option=True),
+    "buildupdater" : Command("Calls the updater build script", BuildUpdater, False,
+        inputs=lambda param: [CyberLibDir],
+        outputs=lambda param: [UpdaterBuildDir, os.path.join(CyberLibDir, "UpdaterAvalonia"), os.path.join(CyberLibDir, "Common Libraries")],
+        fingerprint=lambda param: [os.path.join(UpdaterBuildDir, rid) for rid in UpdaterRids(PlannedBuilds())]),
+    "rmpdbs": Command("Remove all pdb files", RemovePDBs, False,
+        outputs=lambda param: [OutputDir]),
+    "lib": Command("Makes a library directory for dlls", MakeLibraryDir, "Enter a compile target: ", #compiletarget/s arg
+        outputs=lambda param: [os.path.join(OutputDir, target) for target in ParamTargets(param)]),
+    "dlffmpeg": Command("Downloads ffmpeg binaries from their recommended sources", DownloadFFmpeg, False,
+        outputs=lambda param: [os.path.join(DepsDir, "ffmpeg", OS), CacheDir]),
+    "mirror": Command("Serve the dependency downloads from a mirror, <url>/<host>/<path>", SetMirror, "Enter mirror url: ", option=True), #mirror url arg
+    "offline": Command("Only use the dependency cache in deps/.cache", SetOffline, False, option=True),
+    "dlmpv": Command("Downloads mpv binaries from their recommended sources (only Windows currently)", DownloadMpv, False,
+        outputs=lambda param: [os.path.join(DepsDir, "mpv", OS), CacheDir]),
+    "cpymds": Command("Copy all markdown files from working directory", CopyMDs, False,
+        inputs=lambda param: [DocsDir],
+        outputs=lambda param: InBuilds(*[os.path.basename(md) for md in ListFiles(DocsDir, filter=".md")])(param)),
+    "cpyupdater": Command("Copy updater to each build", CopyUpdater, False,
+        inputs=lambda param: [UpdaterBuildDir],
+        outputs=InBuilds("updater")),
+    "hardlinks": Command("Stage the cpy* files with hardlinks when reflinks are unavailable (the output then shares modes with deps/ and docs/)", EnableHardlinks, False, option=True),
+    "cpyffmpeg": Command("Copy ffmpeg executables to builds", CopyFFmpeg, False,
+        inputs=lambda param: [os.path.join(DepsDir, "ffmpeg")],
+        outputs=InBuilds("ffmpeg")),
+    "cpympv": Command("Copy libmpv to builds", CopyMpvLib, False,
+        inputs=lambda param: [os.path.join(DepsDir, "mpv")],
+        outputs=InBuilds("libmpv-2.dll", "libmpv.so.2", "libmpv.2.dylib")),
+    "cpymediainfo": Command("Copy mediainfo executables to builds", CopyMediaInfo, False,
+        inputs=lambda param: [os.path.join(DepsDir, "mediainfo")],
+        outputs=InBuilds("mediainfo")),
+    "zip": Command("Zip each build", ZipBuilds, False,
+        inputs=lambda param: PlannedBuilds(),
+        outputs=lambda param: [build + ".zip" for build in PlannedBuilds()]),
+    "targz": Command("Archive each chosen build as <target>.tar.gz", TarBuilds, "Enter a compile target: ", #compiletarget/s arg
+        inputs=lambda param: [os.path.join(OutputDir, target) for target in ParamTargets(param)],
+        outputs=lambda param: [os.path.join(OutputDir, f"{target}.tar.gz") for target in ParamTargets(param)]),
+    "linuxpkg": Command("Archive a linux build and its setup (CVP-<target>-setup.tar.gz)", CreateLinuxSetup, "Enter a compile target: ", #compiletarget arg
+        inputs=lambda param: [os.path.join(OutputDir, param), os.path.join(BuildDir, "setup-config-linux")],
+        outputs=lambda param: [os.path.join(OutputDir, f"{param}.tar.gz"), os.path.join(OutputDir, f"CVP-{param}-setup.tar.gz")]),
+    "archivelevel": Command("Set the compression level (0-9) used by zip, targz and linuxpkg", SetCompressionLevel, "Enter compression level: ", option=True), #level arg
+    "winpkg": Command("Creates a windows installer with innosetup", CreateWindowsInstaller, False,
+        inputs=lambda param: [os.path.join(OutputDir, "win-x64"), ConfigWinDir],
+        outputs=lambda param: [os.path.join(OutputDir, "CVP-win-x64-setup.exe")]),
+    "report": Command("Print artifact sizes per target and category and the files duplicated across targets", ArtifactReport, False,
+        inputs=lambda param: [OutputDir],
+        outputs=lambda param: [os.path.join(LogsDir, "artifacts.json")]),
+    "budgets": Command("Fail -report when a size budget is exceeded, a json file of MiB by target, target/category, */category or duplicates", SetSizeBudgets, "Enter size budgets file: ", option=True), #budgets file arg
+    "docstohtml": Command("Converts all .md doc files to .html format", DocsToHtml, True,
+        inputs=lambda param: [DocsDir],
+        outputs=lambda param: [param]),
+    "profile": Command("Record wall time, child cpu/rss and bytes moved per command and subprocess into build/logs/profile*.json", SetProfile, False, option=True),
+    "dry-run": Command("Print the plan for the given commands without running them", SetDryRun, False, option=True),
 }
 
-def ParseArgs(args: list[str]) -> list[Command]:
+def ParseArgs(args: list[str]) -> list[Task]:
     result = []
     for x in range(0, len(args)):
         if args[x].startswith('-'):
             if args[x][1:] in Commands:
                 newCommand = Commands[args[x][1:]]
                 if newCommand.hasParam == False:
-                    result.append(newCommand)
+                    result.append(Task(args[x][1:], newCommand, None))
                 else:
-                    newCommand = Command(None, newCommand.function, args[x + 1])
-                    result.append(newCommand)
+                    result.append(Task(args[x][1:], newCommand, args[x + 1]))
             else:
                 raise Exception(f"{args[x]} is not a command")
     return result
 
+def Overlaps(first: list[str], second: list[str]) -> bool:
+    for a in first:
+        for b in second:
+            a, b = os.path.normcase(os.path.abspath(a)), os.path.normcase(os.path.abspath(b))
+            if a == b or a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep):
+                return True
+    return False
+
+Plan = collections.namedtuple('Plan', ['task', 'inputs', 'outputs', 'after', 'version'])
+
+def PlanTasks(tasks: list[Task]) -> list[Plan]:
+    """Resolves each task's paths and the earlier tasks it has to wait for"""
+    plans = []
+    version = Version
+    PlannedTargets.clear()
+    for task in tasks:
+        inputs = task.command.inputs(task.param) if task.command.inputs else []
+        outputs = task.command.outputs(task.param) if task.command.outputs else []
+        after = [i for i, plan in enumerate(plans) if Overlaps(outputs, plan.inputs + plan.outputs) or Overlaps(inputs, plan.outputs)]
+        plans.append(Plan(task, inputs, outputs, after, version))
+        if task.name == "version":
+            version = task.param
+        elif task.name == "resetversion":
+            version = None
+        elif task.name == "compile":
+            PlannedTargets.extend(ParamTargets(task.param))
+    return plans
+
+def LoadTaskState() -> dict:
+    state = {"tasks": {}, "hashes": {}}
+    if os.path.isfile(TaskStatePath):
+        with open(TaskStatePath, 'r') as file:
+            state.update(json.load(file))
+    return state
+
+def StampedSha256(path: str) -> str:
+    """Hash of a version stamped file with its version reset, the planned version is part of the fingerprint instead"""
+    with open(path, 'rb') as file:
+        return hashlib.sha256(StampData(file.read(), DefaultVersionStamps[path])).hexdigest()
+
+def Fingerprint(plan: Plan, artifacts: list[str], hashes: dict) -> str:
+    """Hash of the task, its param, the planned version, the artifacts it produces and the content of every input file"""
+    sha = hashlib.sha256(json.dumps([plan.task.name, plan.task.param, plan.version, sorted(os.path.relpath(artifact, RepoDir) for artifact in artifacts)]).encode())
+    for input in plan.inputs:
+        if os.path.isfile(input):
+            files = [input]
+        else:
+            files = []
+            for root, dirs, names in os.walk(input):
+                dirs[:] = sorted(name for name in dirs if name not in ("bin", "obj", ".git") and os.path.normcase(os.path.abspath(os.path.join(root, name))) not in ArtifactDirs)
+                files += [os.path.join(root, name) for name in sorted(names)]
+        for file in files:
+            stat = os.stat(file)
+            cached = hashes.get(file)
+            if cached == None or cached[0] != stat.st_size or cached[1] != stat.st_mtime_ns:
+                cached = [stat.st_size, stat.st_mtime_ns, StampedSha256(file) if file in DefaultVersionStamps else FileSha256(file)]
+                hashes[file] = cached
+            sha.update(f"{os.path.relpath(file, RepoDir)}:{cached[2]}\n".encode())
+    return sha.hexdigest()
+
+def IsUpToDate(plan: Plan, state: dict) -> tuple[bool, str | None]:
+    if not plan.task.command.fingerprint:
+        return False, None
+    artifacts = plan.task.command.fingerprint(plan.task.param)
+    fingerprint = Fingerprint(plan, artifacts, state["hashes"])
+    taskKey = f"{plan.task.name} {plan.task.param or ''}".strip()
+    artifactsExist = all(os.path.exists(artifact) and (not os.path.isdir(artifact) or os.listdir(artifact)) for artifact in artifacts)
+    return state["tasks"].get(taskKey) == fingerprint and artifactsExist, fingerprint
+
+def RecordTask(plan: Plan, fingerprint: str, hashes: dict):
+    with TaskStateLock:
+        state = LoadTaskState()
+        state["hashes"].update(hashes)
+        state["tasks"][f"{plan.task.name} {plan.task.param or ''}".strip()] = fingerprint
+        with open(TaskStatePath + ".tmp", 'w') as file:
+            json.dump(state, file, indent=4)
+        os.replace(TaskStatePath + ".tmp", TaskStatePath)
+
+def TaskLabel(task: Task) -> str:
+    return f"-{task.name}" + (f" {task.param}" if task.param not in (None, True) else "")
+
+def PrintPlan(plans: list[Plan]):
+    state = LoadTaskState()
+    waves = []
+    for plan in plans:
+        waves.append(1 + max((waves[i] for i in plan.after), default=0))
+    print("Plan:")
+    for wave in range(1, max(waves, default=0) + 1):
+        print(f"wave {wave}:")
+        for i, plan in enumerate(plans):
+            if waves[i] != wave:
+                continue
+            after = ", ".join(TaskLabel(plans[j].task) for j in plan.after)
+            upToDate = IsUpToDate(plan, state)[0]
+            print(f"    {TaskLabel(plan.task)}{' (up to date, skipped)' if upToDate else ''}{f'  after {after}' if after else ''}")
+
+def RunTask(plan: Plan, parent: Span | None):
+    with Span(TaskLabel(plan.task), "command", parent):
+        RunPlannedTask(plan)
+
+def RunPlannedTask(plan: Plan):
+    state = LoadTaskState()
+    upToDate, fingerprint = IsUpToDate(plan, state)
+    if upToDate:
+        print(f"{TaskLabel(plan.task)} is up to date, skipping")
+        return
+    if plan.task.param == None:
+        plan.task.command.function()
+    else:
+        plan.task.command.function(plan.task.param)
+    if fingerprint != None:
+        RecordTask(plan, fingerprint, state["hashes"])
+
+def RunTasks(tasks: list[Task]):
+    """Runs each task once the tasks it waits for are done, independent ones concurrently"""
+    plans = PlanTasks(tasks)
+    if DryRun:
+        PrintPlan(plans)
+        return
+    done = set()
+    started = set()
+    running = {}
+    failure = None
+    parent = getattr(Span.Current, "span", None)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=Jobs or os.cpu_count() or 1) as executor:
+        while len(done) < len(plans):
+            if failure == None:
+                for i, plan in enumerate(plans):
+                    if i not in started and all(j in done for j in plan.after):
+                        started.add(i)
+                        running[executor.submit(RunTask, plan, parent)] = i
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                try:
+                    future.result()
+                    done.add(i)
+                except Exception as e:
+                    print(f"{TaskLabel(plans[i].task)} failed: {e}")
+                    failure = failure or e
+    if failure != None:
+        raise failure
+
 def Main(args: list[str]):
     if len(args) > 0:
         #call each command with params from args
-        callCommands = ParseArgs(args)
-        for callCommand in callCommands:
-            if callCommand.hasParam == False:
-                callCommand.function()
-            else:
-                callCommand.function(callCommand.hasParam)
+        tasks = ParseArgs(args)
+        for task in tasks:
+            if task.command.option:
+                task.command.function() if task.param == None else task.command.function(task.param)
+        try:
+            with Span("build.py " + " ".join(args), "run"):
+                try:
+                    RunTasks([task for task in tasks if not task.command.option])
+                finally:
+                    if RestoreOnce:
+                        ShutdownBuildServers()
+        finally:
+            if ProfileSpans != None:
+                WriteProfile()
         return
 
     userInput = None
@@ -592,6 +2143,8 @@ def Main(args: list[str]):
                     PrintTargetOptions()
                 param = input(Commands[userInput].hasParam)
                 Commands[userInput].function(param)
+    if RestoreOnce:
+        ShutdownBuildServers()
 
 if __name__ == "__main__":
     Main(sys.argv[1:])
@@ -7,7 +7,7 @@ using static System.Environment;
 
 namespace CyberPlayer.Player;
 
-public static class BuildConfig
+public static partial class BuildConfig
 {
     public const string SettingsFileName = "settings.json";
     
@@ -19,7 +19,9 @@ public static class BuildConfig
         SettingsFileName
     ];
 
+#if !INJECTED_VERSION
     public static readonly SemanticVersion Version = new(1, 0, 0);
+#endif
 
     public static readonly string SettingsPath =
         OperatingSystem.IsMacOS() ?